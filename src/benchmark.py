@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Benchmarks of the processing of PIRENEA data, on synthetic spectra and
+files (see pkg.synthetic).
+
+    python benchmark.py --points 1048576 4194304 --json results.json
+    python benchmark.py --suite files --json new.json --compare results.json
+
+pkg.benchmark Created on 18 oct. 2026
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pkg.dataset import RawDataset
+from pkg.peaks import Peaks
+from pkg.pipeline import Pipeline
+from pkg.spectrum import Calibration, FrequencySpectrum, MassSpectrum
+from pkg.synthetic import transient, write_file
+log = logging.getLogger("root")
+
+# calibration and masses of the synthetic files
+REF_MASS = 300.0939
+CYCLO_FREQ = 255.692e3
+MAG_FREQ = 0.001e3
+MASSES = (280.0, 295.0, 296.0, 300.0939, 301.1, 302.2, 320.5)
+
+
+def noise_spectrum(candidates, seed=0):
+    """
+    Return a synthetic spectrum with about candidates local maxima : the
+    absolute value of a white noise has one local maximum every 3 points.
+    """
+    rng = np.random.default_rng(seed)
+    return np.abs(rng.standard_normal(3 * candidates))
+
+
+def detect_peaks_legacy(x, ind, mpd, kpsh=False):
+    """
+    Minimum peak distance suppression of detect_peaks before it was sorted
+    by position : one pass over all the peaks per peak kept, O(k^2).
+    """
+    ind = ind[np.argsort(x[ind])][::-1]
+    idel = np.zeros(ind.size, dtype=bool)
+    for i in range(ind.size):
+        if not idel[i]:
+            idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
+                & (x[ind[i]] > x[ind] if kpsh else True)
+            idel[i] = 0
+    return np.sort(ind[~idel])
+
+
+def bench_detect_peaks(sizes=(10000, 30000, 100000), mpd=20, legacy_max=100000):
+    """
+    Time Peaks.detect_peaks with a minimum peak distance on noise spectra
+    of sizes candidates, and compare with the legacy suppression up to
+    legacy_max candidates.
+    Return a list of dict, one per size.
+    """
+    p = Peaks()
+    results = []
+    for size in sizes:
+        x = noise_spectrum(size)
+        candidates = p.detect_peaks(x, mpd=1)
+        t = time.perf_counter()
+        ind = p.detect_peaks(x, mpd=mpd)
+        elapsed = time.perf_counter() - t
+        result = {"candidates": len(candidates), "peaks": len(ind), "time": elapsed}
+        if size <= legacy_max:
+            t = time.perf_counter()
+            legacy = detect_peaks_legacy(x, candidates, mpd)
+            result["legacy_time"] = time.perf_counter() - t
+            result["same_peaks"] = bool(np.array_equal(ind, legacy))
+        results.append(result)
+    return results
+
+
+def bench_centroid(points=4000000, step=1e-6, hann=True, repeat=3):
+    """
+    Compare the precision (ppm) and the throughput (spectra/s) of the peak
+    masses given by Peaks.masstab_arrays : bins of the spectrum, bins of the
+    spectrum of the signal zero filled twice (zero_twice), and sub-bin
+    centroiding ("parabolic", "gaussian") without zero filling.
+    Return a list of dict, one per method.
+    """
+    calibration = Calibration(REF_MASS, CYCLO_FREQ, MAG_FREQ)
+    masses = np.arange(200.0, 460.0, 20.0) + np.random.default_rng(1).uniform(-0.5, 0.5, 13)
+    signal = transient(masses, points, step, calibration=calibration)
+    if hann:
+        signal *= np.hanning(points)
+    p = Peaks()
+    results = []
+    for method, zero_fill, centroid in (("bins", 1, None), ("zero_twice", 2, None),
+                                        ("parabolic", 1, "parabolic"),
+                                        ("gaussian", 1, "gaussian")):
+        t = time.perf_counter()
+        for dummy in range(repeat):
+            padded = np.zeros(points * zero_fill)
+            padded[:points] = signal
+            fs = FrequencySpectrum(padded, step)
+            mass, intensity = p.masstab_arrays(calibration.mass(fs.freq), fs.spectrum, masses,
+                                               0.2, centroid=centroid)
+        elapsed = (time.perf_counter() - t) / repeat
+        error = np.abs(mass / masses - 1.0) * 1e6
+        results.append({"method": method, "points": points * zero_fill,
+                        "mean_ppm": float(error.mean()), "max_ppm": float(error.max()),
+                        "time": elapsed, "spectra_per_s": 1.0 / elapsed})
+    return results
+
+
+def timed(function, repeat=3):
+    """
+    Call function repeat times : return (its last result, dict of the best
+    and median times in s).
+    """
+    times = []
+    for dummy in range(max(repeat, 1)):
+        t = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t)
+    return result, {"best": min(times), "median": statistics.median(times), "repeat": len(times)}
+
+
+def bench_file(filename, repeat=3, mph=5.0, mpd=20, accuracy=0.2):
+    """
+    Time each step of the processing of one PIRENEA file (RawDataset,
+    FrequencySpectrum, MassSpectrum, Peaks.detect_peaks, Peaks.masstab_peaks)
+    and a full Pipeline run, with the masses and calibration of the
+    synthetic files. Return a list of dict, one per step.
+    """
+    raw, read = timed(lambda: RawDataset(filename), repeat)
+    signal = raw.signal
+    fs, fft = timed(lambda: FrequencySpectrum(signal, raw.step, factor=1000.0).spectrum, repeat)
+    freq = FrequencySpectrum(signal, raw.step).freq
+    ms, mass = timed(lambda: MassSpectrum(freq, REF_MASS, CYCLO_FREQ, MAG_FREQ), repeat)
+    p = Peaks()
+    peaks, detect = timed(lambda: p.detect_peaks(fs, mph, mpd), repeat)
+    found, masstab = timed(lambda: p.masstab_peaks(ms.mass, fs, MASSES, accuracy), repeat)
+
+    def full():
+        pip = Pipeline(filename)
+        pip.process_signal(pip.start, pip.end, True)
+        pip.process_spectrum(1000.0, REF_MASS, CYCLO_FREQ, MAG_FREQ)
+        pip.process_peaks(mph, mpd, min(MASSES) - 1.0, max(MASSES) + 1.0)
+        return p.masstab_arrays(pip.mass, pip.spectrum, MASSES, accuracy, centroid="gaussian")
+    (peak_mass, dummy), pipeline = timed(full, repeat)
+
+    error = np.abs(np.asarray(list(found[0].values())) / np.asarray(MASSES) - 1.0) * 1e6
+    pipeline_error = np.abs(peak_mass / np.asarray(MASSES) - 1.0) * 1e6
+    steps = (("RawDataset", read, {"bytes": os.path.getsize(filename)}),
+             ("FrequencySpectrum", fft, {"bins": len(fs)}),
+             ("MassSpectrum", mass, {}),
+             ("detect_peaks", detect, {"peaks": len(peaks)}),
+             ("masstab_peaks", masstab, {"max_ppm": float(error.max())}),
+             ("Pipeline", pipeline, {"max_ppm": float(pipeline_error.max())}))
+    results = []
+    for name, times, extra in steps:
+        result = {"name": name}
+        result.update(times)
+        result.update(extra)
+        results.append(result)
+    return results
+
+
+def bench_files(points_list=(1048576, 4194304), setups=("new", "old"), step=1e-6, repeat=3,
+                directory=None):
+    """
+    Write a synthetic file per setup and number of points (in directory, by
+    default a temporary one, removed after) and time its processing (see
+    bench_file). Return a list of dict, one per file and step.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for points in points_list:
+            for setup in setups:
+                filename = os.path.join(tmp, "SYN_%s_%d_000.A00" % (setup, points))
+                write_file(filename, setup, points, step, MASSES, tau=0.5, excitation=0.01,
+                           calibration=Calibration(REF_MASS, CYCLO_FREQ, MAG_FREQ))
+                for result in bench_file(filename, repeat):
+                    result.update({"suite": "files", "setup": setup, "points": points})
+                    results.append(result)
+                os.remove(filename)
+    return results
+
+
+def environment(label=""):
+    """
+    Return the description of the machine and versions of a benchmark run.
+    """
+    import scipy
+    return {"label": label, "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count()}
+
+
+def result_key(result):
+    return (result.get("suite", ""), result.get("name", result.get("method", "")),
+            result.get("setup", ""), result.get("points", result.get("candidates", 0)))
+
+
+def compare(baseline, results):
+    """
+    Return (key, baseline time, time, ratio) for each result also in
+    baseline (results of a previous run, as written by --json) : a ratio
+    above 1.0 is a slow down.
+    """
+    def seconds(result):
+        return result.get("best", result.get("time", 0.0))
+    before = {result_key(result): seconds(result) for result in baseline["results"]}
+    rows = []
+    for result in results:
+        key = result_key(result)
+        if before.get(key, 0.0) > 0.0:
+            rows.append((key, before[key], seconds(result), seconds(result) / before[key]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the PIRENEA processing")
+    parser.add_argument("--suite", nargs="+", choices=["files", "detect_peaks", "centroid"],
+                        default=["files", "detect_peaks", "centroid"], help="benchmarks to run")
+    parser.add_argument("--points", nargs="+", type=int, default=[1048576, 4194304],
+                        help="points of the synthetic files (1M to 32M)")
+    parser.add_argument("--setups", nargs="+", choices=["new", "old"], default=["new", "old"],
+                        help="formats of the synthetic files")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each step")
+    parser.add_argument("--directory", default=None,
+                        help="directory of the synthetic files (default : temporary)")
+    parser.add_argument("--label", default="", help="label of the run (version...)")
+    parser.add_argument("--json", default="", help="json file of the results")
+    parser.add_argument("--compare", default="", help="json file of a previous run")
+    args = parser.parse_args(argv)
+
+    results = []
+    if "files" in args.suite:
+        for result in bench_files(args.points, args.setups, repeat=args.repeat,
+                                  directory=args.directory):
+            print("{name:17s} {setup:3s} {points:9d} points : {best:.4f} s "
+                  "(median {median:.4f} s)".format(**result))
+            results.append(result)
+
+    if "detect_peaks" in args.suite:
+        for result in bench_detect_peaks():
+            text = "detect_peaks : {candidates:7d} candidates, {peaks:6d} peaks, {time:.3f} s"
+            if "legacy_time" in result:
+                text += " (legacy : {legacy_time:.3f} s, same peaks : {same_peaks})"
+            print(text.format(**result))
+            result.update({"suite": "detect_peaks", "name": "detect_peaks"})
+            results.append(result)
+
+    if "centroid" in args.suite:
+        for result in bench_centroid(repeat=args.repeat):
+            print("masstab {method:10s} : {points:8d} points, error {mean_ppm:.3f} ppm "
+                  "(max {max_ppm:.3f}), {time:.3f} s, "
+                  "{spectra_per_s:.2f} spectra/s".format(**result))
+            result.update({"suite": "centroid", "name": result["method"]})
+            results.append(result)
+
+    if args.json:
+        with open(args.json, mode="w", encoding="utf_8") as file:
+            json.dump({"environment": environment(args.label), "results": results}, file,
+                      indent=1)
+
+    if args.compare:
+        with open(args.compare, mode="r", encoding="utf_8") as file:
+            baseline = json.load(file)
+        for key, before, after, ratio in compare(baseline, results):
+            print("{:40s} {:9.4f} s -> {:9.4f} s  x{:.2f}".format(
+                " ".join(str(item) for item in key if item != ""), before, after, ratio))
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
+
+else:
+    log.info("Importing... %s", __name__)
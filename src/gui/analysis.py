@@ -189,17 +189,16 @@ class AnalysisGUI(QDockWidget):
             self.plotSpecRaisedSignal.emit(
                 self.shortname, self.pip.spectrum, self.pip.freq)
 
-        x = self.pip.mass
-        mask = [(x >= self.mass_x1) & (x <= self.mass_x2)]
-        x = self.pip.mass[mask]
-        y = self.pip.spectrum[mask]
+        window = self.pip.window(self.mass_x1, self.mass_x2)
+        x = self.pip.mass[window]
+        y = self.pip.spectrum[window]
         self.plotMassRaisedSignal.emit(
             self.shortname, y, x,
             float(self.ref_mass), float(self.cyclo_freq), float(self.mag_freq),
             bool(self.hold))
 
-        x = self.pip.mass[self.pip.mask]
-        y = self.pip.spectrum[self.pip.mask]
+        x = self.pip.mass[self.pip.peaks_window]
+        y = self.pip.spectrum[self.pip.peaks_window]
         self.plotPeaksRaisedSignal.emit(
             self.shortname, y, x, self.pip.ind,
             float(self.mph), int(self.mpd), float(self.peaks_x1),
@@ -221,10 +220,9 @@ class AnalysisGUI(QDockWidget):
     def save_to_ascii_file(self):
         log.debug("event from %s", self.sender())
         if len(self.filename) > 0:
-            x = self.pip.mass
-            mask = [(x >= self.peaks_x1) & (x <= self.peaks_x2)]
-            x = self.pip.mass[mask][::-1]
-            y = self.pip.spectrum[mask][::-1]
+            window = self.pip.window(self.peaks_x1, self.peaks_x2)
+            x = self.pip.mass[window][::-1]
+            y = self.pip.spectrum[window][::-1]
             try:
                 if len(self.ascii_dir) == 0:
                     self.change_ascii_dir()
@@ -194,16 +194,14 @@ if __name__ == '__main__':
     pip = Pipeline(filename)
     pip.process_signal(0, 32000000, False, False, False, False)
     pip.process_spectrum(1000.0, 300.0939, 255.692 * 1e3, 0.001 * 1e3)
-#     x = pip.mass
-#     mask = [(x >= 10.0) & (x <= 1000.0)]
-#     x = pip.mass[mask]
+#     window = pip.window(10.0, 1000.0)
+#     x = pip.mass[window]
 #     print(len(x))
-    x = pip.freq
-    mask = [(x >= 10.0) & (x <= 800000.0)]
-    x = pip.freq[mask]
+    window = slice(np.searchsorted(pip.freq, 10.0), np.searchsorted(pip.freq, 800000.0, 'right'))
+    x = pip.freq[window]
     print(len(x))
 
-    y = pip.spectrum[mask]
+    y = pip.spectrum[window]
 
 #     y = pip.spectrum[10:1000000]
 #     x = pip.mass[10:1000000]
@@ -13,10 +13,8 @@ log = logging.getLogger("root")
 
 if __name__ == '__main__':
 
-    import numpy as np
     import os
-    from pkg.pipeline import Pipeline
-    from pkg.peaks import Peaks
+    from pkg.batch import BatchJob
 
     out_filename = "D:\\PIRENEA\\DATA\\MASS\\My_Masstab_File.txt"
 
@@ -37,49 +35,28 @@ if __name__ == '__main__':
     # # Put your own settings here
     mass_list = [89.0, 151.0, 152.0, 176.0, 177.0, 178.0]
 
-    mass_list = sorted(mass_list)
     acc = 0.2  # This is accuracy for peak search, in mass unit
-    list_i = [[0] * len(filename_list) for i in range(len(mass_list))]
-
-    # File header
-    text = "\n" + " " * 24
-    for mass in mass_list:
-        text = text + (str(mass) + "_M").ljust(9) + (str(mass) + "_I").ljust(9)
-    text = text + "\n" + "=" * 21
-
-    # Loop for filenames
-    for i, filename in enumerate(filename_list):
-        # Signal processing
-        pip = Pipeline(filename)
-        # Put your own settings here: start signal, end signal and Hanning
-        start = pip.start
-        start = 10000
-        end = pip.end
-        end = 1010000
-        hann = False
-        pip.process_signal(start, end, hann, False, False, False)
-        pip.process_spectrum(factor=1000.0, ref_mass=300.0939, cyclo_freq=255.692e3,
-                             mag_freq=0.001e3)
-
-        x = np.asarray(pip.mass)
-        y = np.asarray(pip.spectrum)
-
-        # Peak search
-        p = Peaks()
-        dict_m, dict_i = p.masstab_peaks(x, y, mass_list, acc)
-
-        short_name = os.path.basename(filename)
-        text = text + "\n" + str(short_name).ljust(24)
-        for mass in mass_list:
-            text = text + \
-                "{:.4f}".format(float(dict_m[mass])).ljust(9) + \
-                "{:.3f}".format(float(dict_i[mass])).ljust(9)
+    # reference masses to refit the calibration of each file ([] : no refit)
+    ref_list = []
+    # interpolate the peaks between bins ("parabolic" or "gaussian" : no need
+    # to zero fill the signal for a precise mass), None : highest bin
+    centroid = None
+    # Put your own settings here: start signal, end signal and Hanning
+    start = 10000
+    end = 1010000
+    hann = False
+
+    # Signal processing of all the files, on all the cores: only [start:end]
+    # is read from the files (see also: python sofa.py batch --help)
+    job = BatchJob(filename_list, mass_list, accuracy=acc, start=start, end=end, hann=hann,
+                   factor=1000.0, ref_mass=300.0939, cyclo_freq=255.692e3, mag_freq=0.001e3,
+                   ref_list=ref_list, centroid=centroid)
+    job.run()
 
     # Write result into file: this is the same masstab.txt file as within sofa
-    with open(out_filename, mode='w', encoding='utf_8') as file:
-        file.write(text)
+    job.write(out_filename)
     # debug
-    print(text)
+    print(job.table())
 
 else:
     log.info("Importing... %s", __name__)
@@ -16,8 +16,10 @@ if __name__ == '__main__':
     import numpy as np
     import os
     import matplotlib.pyplot as plt
+    from pkg.batch import masstab_header, masstab_row
     from pkg.pipeline import Pipeline
     from pkg.peaks import Peaks
+    from pkg.prefetch import ReadAhead
 
     out_filename = "D:\\PIRENEA\\DATA\\MASS\\My_Masstab_Loop.txt"
 
@@ -36,42 +38,46 @@ if __name__ == '__main__':
     mass_list = [300.0, 298.0, 296.0, 301.0, 302.0]
     mass_list = sorted(mass_list)
     acc = 0.2  # This is accuracy for peak search, in mass unit
+    # reference masses to refit the calibration of each file ([] : no refit)
+    ref_list = []
+    # interpolate the peaks between bins ("parabolic" or "gaussian" : no need
+    # to zero fill the signal for a precise mass), None : highest bin
+    centroid = None
     hann = False
     list_i = [[0] * len(filename_list) for i in range(len(mass_list))]
 
     # File header
-    text = "\n" + " " * 24
-    for mass in mass_list:
-        text = text + (str(mass) + "_M").ljust(9) + (str(mass) + "_I").ljust(9)
-    text = text + "\n" + "=" * 21
+    parts = [masstab_header(mass_list)]
 
-    # Loop for filenames
-    for i, filename in enumerate(filename_list):
+    # Loop for filenames: next files are read while the current one is processed
+    # the .xml files are not used here
+    reader = ReadAhead(filename_list, depth=4, xml=False)
+    for i, item in enumerate(reader):
+        filename = item.filename
         # Signal processing
-        pip = Pipeline(filename)
+        pip = Pipeline(filename, buffer=item.data)
         pip.process_signal(pip.start, pip.end, hann, False, False, False)
         pip.process_spectrum(factor=1000.0, ref_mass=300.0939, cyclo_freq=255.692e3,
                              mag_freq=0.001e3)
+        if ref_list:
+            pip.mass_recalibrate(ref_list, acc)
 
         x = np.asarray(pip.mass)
         y = np.asarray(pip.spectrum)
 
         # Peak search
         p = Peaks()
-        dict_m, dict_i = p.masstab_peaks(x, y, mass_list, acc)
+        masses, intensities = p.masstab_arrays(x, y, mass_list, acc, centroid=centroid)
 
-        # Extract dict in list_i for future plots
+        # Extract intensities in list_i for future plots
         for j, mass in enumerate(mass_list):
-            list_i[j][i] = float(dict_i[mass])
+            list_i[j][i] = float(intensities[j])
 
-        short_name = os.path.basename(filename)
-        text = text + "\n" + str(short_name).ljust(24)
-        for mass in mass_list:
-            text = text + \
-                "{:.4f}".format(float(dict_m[mass])).ljust(9) + \
-                "{:.3f}".format(float(dict_i[mass])).ljust(9)
+        parts.append(masstab_row(filename, masses, intensities))
+    reader.report()
 
     # Write result into file
+    text = "".join(parts)
     with open(out_filename, mode='w', encoding='utf_8') as file:
         file.write(text)
     # debug
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Masstab tables of many PIRENEA files, processed in parallel processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+
+from pkg.cache import file_identity
+from pkg.peaks import Peaks
+from pkg.pipeline import Pipeline
+from pkg.profiling import Profiler, profile, summary, summary_lines
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+log = logging.getLogger('root')
+
+
+def find_files(paths, exclude=()):
+    """
+    Return the sorted list of the PIRENEA files of paths : directories (all
+    their files), glob patterns or filenames. .xml and _sc.txt files are
+    left out, and so are the files of exclude : the table, journal... of a
+    job written into a data directory are not processed by the next run.
+    """
+    excluded = set(os.path.normcase(os.path.abspath(f)) for f in exclude if f)
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, f) for f in os.listdir(path)]
+        else:
+            names = glob.glob(path)
+            if not names:
+                log.error("No file found : %s", path)
+        filenames.extend(f for f in names if os.path.isfile(f)
+                         if f[-4:] != ".xml" if f[-7:] != "_sc.txt"
+                         if os.path.normcase(os.path.abspath(f)) not in excluded)
+    return sorted(set(filenames))
+
+
+def masstab_header(mass_list):
+    """
+    Return the header of a masstab table : two columns (mass, intensity)
+    per mass of mass_list (same format as MassTabViewerGUI).
+    """
+    parts = ["\n", " " * 24]
+    for mass in mass_list:
+        parts.append((str(mass) + "_M").ljust(9))
+        parts.append((str(mass) + "_I").ljust(9))
+    parts.append("\n" + "=" * 21)
+    return "".join(parts)
+
+
+def masstab_row(filename, masses, intensities):
+    """
+    Return the line of a masstab table of one file.
+    """
+    parts = ["\n", str(os.path.basename(filename)).ljust(24)]
+    for mass, intensity in zip(masses, intensities):
+        parts.append("{:.4f}".format(float(mass)).ljust(9))
+        parts.append("{:.3f}".format(float(intensity)).ljust(9))
+    return "".join(parts)
+
+
+def masstab_file(filename, params, profiler=None):
+    """
+    Process one file with params (see BatchJob) and return (filename,
+    masses, intensities) : lists of the peaks of params["mass_list"].
+    masses and intensities are None if the file could not be processed.
+
+    :param profiler: a pkg.profiling.Profiler, to record the stages of the
+                     file (and the whole file, as stage "file")
+    """
+    with profile(profiler, "file", filename):
+        return _masstab_file(filename, params, profiler)
+
+
+def _masstab_file(filename, params, profiler):
+    try:
+        start, end = params["start"], params["end"]
+        # only [start:end] is read from the file
+        pip = Pipeline(filename, start=start, end=end, profiler=profiler)
+        if start == 0 and end == 0:
+            # limits according to the excitation length of the script
+            start, end = pip.start, pip.end
+        pip.process_signal(start, end, params["hann"], False, False, False)
+        pip.process_spectrum(params["factor"], params["ref_mass"], params["cyclo_freq"],
+                             params["mag_freq"])
+        if params["ref_list"]:
+            pip.mass_recalibrate(params["ref_list"], params["accuracy"])
+        peaks = Peaks(profiler=profiler)
+        mass, intensity = peaks.masstab_arrays(pip.mass, pip.spectrum, params["mass_list"],
+                                               params["accuracy"], centroid=params["centroid"])
+        return filename, mass.tolist(), intensity.tolist()
+    except Exception as error:
+        # a bad file (or a worker out of memory) must not stop the batch
+        log.error("Unable to process %s : %r", filename, error)
+        return filename, None, None
+
+
+def profile_file(filename, params):
+    """
+    masstab_file() with a Profiler : return (result of masstab_file, records
+    of the stages of the file, as dicts).
+    """
+    profiler = Profiler()
+    result = masstab_file(filename, params, profiler)
+    profiler.stop()
+    return result, profiler.as_dicts()
+
+
+def limit_memory(max_bytes):
+    """
+    Limit the address space of the current process to max_bytes (0 : no
+    limit), where the platform allows it : an allocation beyond it raises
+    MemoryError instead of swapping.
+    """
+    if max_bytes <= 0:
+        return
+    if resource is None:
+        log.warning("Memory limit not available on this platform")
+        return
+    dummy, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def _limited(worker, filename, params, max_bytes):
+    """
+    worker(filename, params) in a worker process limited to max_bytes (see
+    limit_memory) : the initializer of ProcessPoolExecutor is new in Python
+    3.7, so the limit is set again for each file.
+    """
+    limit_memory(max_bytes)
+    return worker(filename, params)
+
+
+class BatchJournal(object):
+
+    """
+    Journal of the files processed by BatchJobs : one json line per file
+    processed, with its results, keyed by the identity of the file (see
+    pkg.cache.file_identity) and the parameters of the job. A job run again
+    with the same journal only processes new or modified files.
+    Lines are written as soon as a file is processed : after a crash, the
+    journal holds all the files processed so far.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self.entries = {}
+        self.__read()
+
+    def __read(self):
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, mode='r', encoding='utf_8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    # last line of a job killed while writing
+                    log.warning("Invalid line in journal %s", self.filename)
+        log.info("Journal %s : %d files already processed", self.filename, len(self.entries))
+
+    def key(self, filename, params):
+        """
+        Return the key of filename processed with params, "" if filename
+        does not exist.
+        """
+        try:
+            identity = file_identity(filename)
+        except OSError:
+            return ""
+        text = json.dumps([self.VERSION, identity, params], sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf_8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return (filename, masses, intensities) of key, or None.
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None
+        return entry["filename"], entry["masses"], entry["intensities"]
+
+    def add(self, key, result):
+        """
+        Write the result (filename, masses, intensities) of key.
+        """
+        entry = {"key": key, "filename": result[0], "masses": result[1],
+                 "intensities": result[2]}
+        self.entries[key] = entry
+        with open(self.filename, mode='a', encoding='utf_8') as file:
+            file.write(json.dumps(entry) + "\n")
+
+
+class BatchJob(object):
+
+    """
+    Masstab table of a list of files : each file is processed by a Pipeline
+    in a pool of worker processes, and the peaks of mass_list are written in
+    the same table format as MassTabViewerGUI.
+
+    :Example:
+
+    >>> from pkg.batch import BatchJob, find_files
+    >>> job = BatchJob(find_files(["D:\\PIRENEA\\DATA\\2018\\data_2018_11_06"]),
+    ...                [300.0, 301.0], accuracy=0.2, workers=8)
+    >>> job.run()
+    >>> job.write("D:\\PIRENEA\\DATA\\MASS\\masstab.txt")
+    """
+
+    def __init__(self, filenames=[], mass_list=[], accuracy=0.2, start=0, end=0, hann=False,
+                 factor=1000.0, ref_mass=300.0939, cyclo_freq=255.692e3, mag_freq=0.001e3,
+                 ref_list=[], centroid=None, workers=0, chunksize=1, max_memory=0,
+                 profile=False):
+        """
+        Constructor
+
+        :param start: first sample of the signals (start=end=0 : limits of the
+                      script of each file)
+        :param ref_list: reference masses to refit the calibration of each
+                         file ([] : no refit)
+        :param centroid: "parabolic" or "gaussian" to interpolate the peaks
+        :param workers: number of worker processes (0 : number of cores,
+                        1 : no worker process)
+        :param chunksize: number of files sent at once to a worker
+        :param max_memory: memory limit of each worker in bytes (0 : none)
+        :param profile: record the stages of each file processed (see
+                        pkg.profiling) into records[]
+        """
+        self.filenames = list(filenames)
+        self.mass_list = sorted(float(mass) for mass in mass_list)
+        self.params = {"mass_list": self.mass_list, "accuracy": accuracy,
+                       "start": start, "end": end, "hann": hann, "factor": factor,
+                       "ref_mass": ref_mass, "cyclo_freq": cyclo_freq, "mag_freq": mag_freq,
+                       "ref_list": list(ref_list), "centroid": centroid}
+        self.workers = workers if workers > 0 else os.cpu_count()
+        self.chunksize = max(chunksize, 1)
+        self.max_memory = max_memory
+        self.profile = profile
+        self.results = []
+        self.records = []
+
+    def run(self, journal=None):
+        """
+        Process all the files : return the list of (filename, masses,
+        intensities), in the order of filenames.
+
+        :param journal: a BatchJournal : files already processed with the
+                        same parameters are skipped, and the files processed
+                        are added to it
+        """
+        t = time.time()
+        done = {}
+        keys = {}
+        if journal is not None:
+            for filename in self.filenames:
+                keys[filename] = journal.key(filename, self.params)
+                result = journal.get(keys[filename])
+                if result is not None:
+                    done[filename] = result
+        todo = [filename for filename in self.filenames if filename not in done]
+        worker = profile_file if self.profile else masstab_file
+        self.records = []
+        if self.workers == 1 or len(todo) < 2:
+            results = (worker(filename, self.params) for filename in todo)
+            self.__collect(results, done, keys, journal)
+        else:
+            max_memory = self.max_memory
+            if max_memory > 0 and resource is None:
+                log.warning("Memory limit not available on this platform")
+                max_memory = 0
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(_limited, itertools.repeat(worker), todo,
+                                       itertools.repeat(self.params),
+                                       itertools.repeat(max_memory), chunksize=self.chunksize)
+                self.__collect(results, done, keys, journal)
+        self.results = [done[filename] for filename in self.filenames]
+        failed = sum(1 for result in self.results if result[1] is None)
+        log.info("%d files processed in %.1f s by %d workers (%d skipped, %d failed)",
+                 len(todo), time.time() - t, self.workers, len(self.filenames) - len(todo),
+                 failed)
+        if self.profile:
+            for line in summary_lines(self.summary()):
+                log.info(line)
+        return self.results
+
+    def __collect(self, results, done, keys, journal):
+        """
+        Store the results of the files processed, and write them into the
+        journal as they come (the files that failed are not written).
+        """
+        for result in results:
+            if self.profile:
+                result, records = result
+                self.records.extend(records)
+            filename = result[0]
+            done[filename] = result
+            if journal is not None and result[1] is not None and keys[filename]:
+                journal.add(keys[filename], result)
+
+    def summary(self):
+        """
+        Return the statistics per stage of the files processed by the last
+        run with profile=True : see pkg.profiling.summary.
+        """
+        return summary(self.records)
+
+    def write_profile(self, out_filename):
+        """
+        Write the records and the summary of the last run into out_filename,
+        in json format.
+        """
+        with open(out_filename, mode='w', encoding='utf_8') as file:
+            json.dump({"records": self.records, "summary": self.summary()}, file, indent=1)
+
+    def table(self):
+        """
+        Return the masstab table of the files processed.
+        """
+        parts = [masstab_header(self.mass_list)]
+        for filename, masses, intensities in self.results:
+            if masses is not None:
+                parts.append(masstab_row(filename, masses, intensities))
+        return "".join(parts)
+
+    def write(self, out_filename):
+        """
+        Write the masstab table into out_filename.
+        """
+        with open(out_filename, mode='w', encoding='utf_8') as file:
+            file.write(self.table())
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Local caches for PIRENEA data, stored in a directory with a bounded size.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+log = logging.getLogger('root')
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".sofa", "cache")
+
+
+def file_identity(filename):
+    """
+    Return (absolute path, size, modification time in ns) of a file:
+    a file is considered unchanged as long as its identity is the same.
+    """
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+
+class DiskCache(object):
+
+    """
+    Directory of entries (one sub-directory per key), evicted in least
+    recently used order when the total size exceeds max_bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=2 * 1024 ** 3):
+        """
+        Constructor
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, *items):
+        """
+        Return a hash of items, used as an entry name.
+        """
+        text = json.dumps(items, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf_8')).hexdigest()
+
+    def entry(self, key):
+        """
+        Return the directory of an entry, or "" if the entry does not exist.
+        """
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            # a hit makes the entry the most recently used
+            os.utime(path, None)
+            return path
+        return ""
+
+    def store(self, key, arrays, header):
+        """
+        Write an entry : arrays as .npy files and header as a json file.
+        The entry is written in a temporary directory, then renamed, so that
+        a partial entry is never visible.
+
+        :param arrays: dict of numpy arrays, saved as <name>.npy
+        :param header: dict of json values
+        """
+        path = os.path.join(self.directory, key)
+        tmp = ""
+        try:
+            tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp")
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, name + ".npy"), array)
+            with open(os.path.join(tmp, "header.json"), mode="w", encoding='utf_8') as file:
+                json.dump(header, file)
+            if os.path.isdir(path):
+                shutil.rmtree(tmp)
+            else:
+                os.rename(tmp, path)
+        except (IOError, OSError) as error:
+            log.error("Unable to write into cache : %s", error)
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+            return ""
+        self.evict()
+        return path
+
+    def size(self, path):
+        """
+        Return the size in bytes of an entry.
+        """
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits max_bytes.
+        """
+        entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory)
+                   if entry.is_dir() and not entry.name.startswith(".tmp")]
+        entries.sort()
+        total = sum(self.size(path) for dummy, path in entries)
+        for dummy, path in entries:
+            if total <= self.max_bytes:
+                break
+            total -= self.size(path)
+            log.debug("Cache eviction : %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class DatasetCache(DiskCache):
+
+    """
+    Native-endian copies of PIRENEA raw files, keyed by file identity.
+
+    :Example:
+
+    >>> from pkg.cache import DatasetCache
+    >>> from pkg.dataset import RawDataset
+    >>> cache = DatasetCache(max_bytes=10 * 1024 ** 3)
+    >>> raw = RawDataset("Y:\\2018\\data_2018_07_20\\P1_2018_07_20_001.A00", cache=cache)
+    """
+
+    VERSION = 1
+
+    def dataset_key(self, filename):
+        return self.key("dataset", self.VERSION, file_identity(filename))
+
+    def load(self, filename):
+        """
+        Return (samples, header) of a fresh cached copy of filename, samples
+        being mapped in memory, or (None, None) if there is no such copy.
+        """
+        try:
+            path = self.entry(self.dataset_key(filename))
+            if not path:
+                return None, None
+            with open(os.path.join(path, "header.json"), mode="r", encoding='utf_8') as file:
+                header = json.load(file)
+            if header.get("version") != self.VERSION:
+                return None, None
+            samples = np.load(os.path.join(path, "samples.npy"), mmap_mode='r')
+            return samples, header
+        except (IOError, OSError, ValueError) as error:
+            log.error("Unable to read from cache : %s", error)
+            return None, None
+
+    def save(self, filename, samples, header):
+        """
+        Store the samples of filename in native byte order, with its header
+        (setup, points, step, gain, offset, script text).
+        """
+        header = dict(header, version=self.VERSION)
+        samples = samples.astype(samples.dtype.newbyteorder('='), copy=False)
+        return self.store(self.dataset_key(filename), {"samples": samples}, header)
+
+
+class SpectrumCache(DiskCache):
+
+    """
+    Frequency spectra computed by a Pipeline, keyed by a hash of the file
+    identity and of the parameters used to process the signal and the FFT.
+
+    :Example:
+
+    >>> from pkg.cache import SpectrumCache
+    >>> from pkg.pipeline import Pipeline
+    >>> pip = Pipeline(filename, spectrum_cache=SpectrumCache())
+    """
+
+    VERSION = 1
+
+    def spectrum_key(self, filename, params):
+        """
+        Return the key of the spectrum of filename processed with params, a
+        tuple of json values.
+        """
+        return self.key("spectrum", self.VERSION, file_identity(filename), params)
+
+    def load(self, key):
+        """
+        Return (spectrum, freq) of a cached spectrum, mapped in memory, or
+        (None, None) if there is no such spectrum.
+        """
+        try:
+            path = self.entry(key)
+            if not path:
+                return None, None
+            spectrum = np.load(os.path.join(path, "spectrum.npy"), mmap_mode='r')
+            freq = np.load(os.path.join(path, "freq.npy"), mmap_mode='r')
+            return spectrum, freq
+        except (IOError, OSError, ValueError) as error:
+            log.error("Unable to read from cache : %s", error)
+            return None, None
+
+    def save(self, key, spectrum, freq):
+        """
+        Store a spectrum and its frequency axis.
+        """
+        header = {"version": self.VERSION, "points": len(spectrum)}
+        return self.store(key, {"spectrum": spectrum, "freq": freq}, header)
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
@@ -7,6 +7,7 @@
 """
 This module manages the PIRENEA raw datasets.
 """
+import io
 import logging
 import os.path
 import struct
@@ -15,11 +16,65 @@ from numpy.core import numeric as num
 from numpy.core import umath as math
 
 import numpy as np
-from pkg.script import Script
+from pkg.profiling import profile
+from pkg.script import Script, script_lines
 
 log = logging.getLogger('root')
 
 
+def read_values(source, offset, dtype, count):
+    """
+    Read count values of type dtype, at offset bytes from the beginning of
+    source : a file name, or the bytes of a file (values are then a read-only
+    view on the bytes).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return np.frombuffer(source, dtype=dtype, count=count, offset=offset)
+    with open(source, mode="rb") as fir:
+        fir.seek(offset)
+        return np.fromfile(fir, dtype=dtype, count=count)
+
+
+def hann_window(index, points, half=False, dtype=np.float64):
+    """
+    Return the values at index (array of sample indices) of a Hann window of
+    points samples, full (as np.hanning) or half : used to window a signal
+    block by block.
+    """
+    index = np.asarray(index, dtype=dtype)
+    if half:
+        return 0.5 + 0.5 * math.cos(index * dtype(math.pi / points))
+    return 0.5 - 0.5 * math.cos(index * dtype(2.0 * math.pi / max(points - 1, 1)))
+
+
+class DatasetHeader(object):
+
+    """
+    Header of a PIRENEA file, as returned by RawDataset.probe().
+    setup is "new" (int16 samples, gain and offset) or "old" (float samples,
+    followed by a script), step is in seconds and size in bytes.
+    """
+    __slots__ = ('filename', 'setup', 'points', 'step', 'gain', 'offset',
+                 'size', 'scriptable')
+
+    def __init__(self, filename, setup, points, step, gain, offset, size, scriptable):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self.setup = setup
+        self.points = points
+        self.step = step
+        self.gain = gain
+        self.offset = offset
+        self.size = size
+        self.scriptable = scriptable
+
+    def __repr__(self):
+        return "DatasetHeader(%s, %s, points=%d, step=%g, gain=%g, offset=%g)" % (
+            self.filename, self.setup, self.points, self.step, self.gain, self.offset)
+
+
 class RawDataset(object):
 
     """
@@ -32,78 +87,263 @@ class RawDataset(object):
     >>> s = RawDataset(filename)
     """
 
-    def __init__(self, filename=""):
+    def __init__(self, filename="", mmap=False, start=0, end=0, dtype=np.float64,
+                 cache=None, write_script=False, buffer=None, profiler=None):
         """
         Constructor
+
+        :param mmap: if True, map the samples of the file instead of reading
+                     them: the calibrated signal is computed on first access,
+                     and truncate() only converts the requested slice.
+        :param start: first sample to read (0 = beginning of the file)
+        :param end: last sample (excluded) to read (0 = end of the file)
+        :param dtype: floating type of the calibrated signal (np.float64 or
+                      np.float32 for single precision processing)
+        :param cache: a DatasetCache, to read the samples from native-endian
+                      copies of the files (None = no cache)
+        :param write_script: if True, also write the script of old files into
+                             a <filename>_sc.txt file (see save_script)
+        :param buffer: bytes of the file, already read (see pkg.prefetch) :
+                       the file itself is then not read, and cache is not used
+        :param profiler: a pkg.profiling.Profiler, to record the "read" stage;
+                         bytes_read is the number of bytes read (or mapped)
+                         from the file or its cached copy
         """
         self.filename = filename
+        self.mmap = mmap
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+        self.write_script = write_script
+        self.buffer = buffer
+        self.profiler = profiler
+        self.bytes_read = 0
+        self.read_start = start
+        self.read_end = end
         self.points = 0
-        self.signal = []
+        self.setup = ""
+        self.samples = []
         self.step = 0.0
+        self.gain = 1.0
+        self.offset = 0.0
         self.start = 0
         self.end = 0
         self.scriptable = False
         self.text = ""
+        self.__signal = None
 
-        self.__read_file()
+        with profile(self.profiler, "read", self.filename) as record:
+            self.__read_file()
+            if record is not None:
+                record.bytes_read += self.bytes_read
 #         self.__find_limits()
 
-    def __read_file(self):
+    @property
+    def signal(self):
         """
-        Read a PIRENEA binary file, in big-endian format.
-        Populate signal[] with the raw signal values and step in microseconds.
+        Calibrated signal (samples * gain + offset), computed on first access.
+        """
+        if self.__signal is None:
+            self.__signal = self.calibrate(self.samples)
+        return self.__signal
+
+    @signal.setter
+    def signal(self, signal):
+        """
+        Replace the calibrated signal [read_start:read_end], for example by
+        the co-addition of several accumulations.
+        """
+        self.__signal = signal
+
+    def calibrate(self, samples):
+        """
+        Convert raw samples into signal values with the gain and offset of the
+        file, in dtype precision. Old PIRENEA files have no gain nor offset :
+        samples are only converted.
+
+        :param samples: raw samples, or a slice of raw samples
+        """
+        signal = np.asarray(samples, dtype=self.dtype)
+        if self.setup == "new":
+            # int16 samples : signal is a new array, scaled in place
+            signal *= self.dtype.type(self.gain)
+            signal += self.dtype.type(self.offset)
+        return signal
+
+    @staticmethod
+    def probe(filename):
+        """
+        Read only the header of a PIRENEA file : number of points, setup,
+        step, gain and offset, by seeking into the file.
+        Return a DatasetHeader, or None if the file is not valid.
+
+        :Example:
+
+        >>> header = RawDataset.probe("Y:\\2018\\data_2018_07_20\\P1_2018_07_20_001.A00")
+        >>> header.points, header.setup
         """
         try:
-            # Read first integer with number of points
-            dt = np.dtype([('points', '>i4')])
-            data = np.fromfile(self.filename, dtype=dt, count=1)
-            self.points = data['points'][0]
-            filesize = os.path.getsize(self.filename)
-            # new PIRENEA setup : samples written as long integer
-            if (filesize < self.points * 4):
-                dt = np.dtype([('points', '>i4'), ('samples', '>i2', self.points),
-                               ('step', '>f4'), ('gain', '>f4'), ('offset', '>f4')])
-                data = np.fromfile(self.filename, dtype=dt)
-                self.signal = data['samples'].ravel() * data['gain'] + data['offset']
-                self.step = data['step'][0]  # step in seconds
-
-                # No script for new PIRENEA setup
-                self.text = ""
+            return RawDataset.__parse_header(filename)
+        except (IOError) as error:
+            log.error("Unable to open : %s", error)
+        except (struct.error, IndexError, ValueError) as error:
+            log.error("Not a valid binary file : %s", error)
+        return None
 
-            else:
-                # old PIRENEA setup : samples written as float
-                dt = np.dtype([('points', '>i4'), ('samples', '>f', (self.points,)),
-                               ('step', '>f')])
-                data = np.fromfile(self.filename, dtype=dt)
-                self.signal = data['samples'].ravel()
-                self.step = data['step'][0] * 1e-6  # step in microseconds
-
-                # Skip the binary part and read the script (readlines is faster)
+    @staticmethod
+    def __parse_header(filename, buffer=None):
+        """
+        Parse the header of a PIRENEA binary file, in big-endian format, from
+        the file or from buffer (the bytes of the file) if given.
+        Raise IOError or ValueError if the file cannot be parsed.
+        """
+        source = filename if buffer is None else buffer
+        filesize = os.path.getsize(filename) if buffer is None else len(buffer)
+        # Read first integer with number of points
+        points = int(read_values(source, 0, '>i4', 1)[0])
+        if points <= 0:
+            raise ValueError("%d points in %s" % (points, filename))
+        # new PIRENEA setup : samples written as short integer
+        if (filesize < points * 4):
+            step, gain, offset = read_values(source, 4 + (2 * points), '>f4', 3)
+            # step in seconds, no script for new PIRENEA setup
+            return DatasetHeader(filename, "new", points, float(step),
+                                 float(gain), float(offset), filesize, False)
+        # old PIRENEA setup : samples written as float, and a script
+        step = read_values(source, 4 + (4 * points), '>f4', 1)[0]
+        # step in microseconds
+        return DatasetHeader(filename, "old", points, float(step) * 1e-6,
+                             1.0, 0.0, filesize, filesize > 4 + (4 * points) + 4)
+
+    def __read_header(self):
+        """
+        Read the number of points, the setup, step in seconds, gain, offset
+        and script of a PIRENEA binary file, in big-endian format, without
+        reading the samples.
+        """
+        header = RawDataset.__parse_header(self.filename, self.buffer)
+        self.bytes_read += 4 + (12 if header.setup == "new" else 4)
+        self.setup = header.setup
+        self.points = header.points
+        self.step = header.step
+        self.gain = header.gain
+        self.offset = header.offset
+        self.text = ""
+        if header.scriptable:
+            # Skip the binary part and read the script (readlines is faster)
+            if self.buffer is None:
                 with open(self.filename, mode="rb") as fir:
-                    fir.read(4 + (4 * self.points) + 4)
+                    fir.seek(4 + (4 * self.points) + 4)
                     self.text = fir.readlines()
+            else:
+                script = io.BytesIO(self.buffer)
+                script.seek(4 + (4 * self.points) + 4)
+                self.text = script.readlines()
+            self.bytes_read += sum(len(line) for line in self.text)
+
+    def __clip_window(self):
+        """
+        Clip [read_start:read_end] to the points of the file.
+        """
+        if self.read_end <= 0 or self.read_end > self.points:
+            self.read_end = self.points
+        self.read_start = min(max(self.read_start, 0), self.read_end)
+
+    def __read_samples(self, start, end, mmap=False):
+        """
+        Read (or map, in mmap mode) the samples [start:end] of the file, or
+        view them in buffer.
+        """
+        dtype = np.dtype('>i2') if self.setup == "new" else np.dtype('>f4')
+        offset = 4 + dtype.itemsize * start
+        self.bytes_read += dtype.itemsize * (end - start)
+        if mmap and self.buffer is None:
+            return np.memmap(self.filename, dtype=dtype, mode='r',
+                             offset=offset, shape=(end - start,))
+        source = self.filename if self.buffer is None else self.buffer
+        return read_values(source, offset, dtype, end - start)
+
+    def __read_cache(self):
+        """
+        Populate samples[] and header values from the cached copy of the file.
+        Return False if there is no fresh copy in cache.
+        """
+        samples, header = self.cache.load(self.filename)
+        if samples is None:
+            return False
+        self.setup = header["setup"]
+        self.points = header["points"]
+        self.step = header["step"]
+        self.gain = header["gain"]
+        self.offset = header["offset"]
+        text = header["text"]
+        self.text = text.encode('latin_1').splitlines(True) if text else ""
+        self.__clip_window()
+        self.samples = samples[self.read_start:self.read_end]
+        self.bytes_read += self.samples.nbytes
+        return True
+
+    def __save_cache(self, samples):
+        """
+        Store a native-endian copy of the whole file in cache.
+        """
+        text = b"".join(self.text).decode('latin_1') if self.text else ""
+        header = {"setup": self.setup, "points": self.points, "step": self.step,
+                  "gain": self.gain, "offset": self.offset, "text": text}
+        self.cache.save(self.filename, samples, header)
+
+    def __read_file(self):
+        """
+        Read a PIRENEA binary file, in big-endian format.
+        Populate samples[] with the raw values between read_start and
+        read_end, step in seconds, gain and offset.
+        In mmap mode, samples[] is only mapped onto the file.
+        With a cache, samples[] is mapped onto a fresh native-endian copy of
+        the file, which is created on first read.
+        """
+        try:
+            if self.cache is None or self.buffer is not None:
+                self.__read_header()
+                self.__clip_window()
+                self.samples = self.__read_samples(self.read_start, self.read_end, self.mmap)
+            elif not self.__read_cache():
+                self.__read_header()
+                self.__clip_window()
+                # the whole file is read once, to create its copy in cache
+                samples = self.__read_samples(0, self.points)
+                self.__save_cache(samples)
+                self.samples = samples[self.read_start:self.read_end]
+
+            if not self.mmap:
+                self.__signal = self.calibrate(self.samples)
 
             if len(self.text) > 0:
                 self.scriptable = True
-                if os.path.isfile(self.filename + "_sc.txt"):
-                    pass
-                else:
-                    with open(self.filename + "_sc.txt", mode="w", encoding='utf_8') as file:
-                        log.info("Script file creation...")
-                        for line in self.text:
-                            # strip removes all whitespace characters
-                            if line.strip():
-                                linew = line.decode('utf_8')
-                                if linew[0] != '/' and linew[0] != '':
-                                    file.write(linew)
             else:
                 self.scriptable = False
 
         except (IOError) as error:
             log.error("Unable to open : %s", error)
-        except (struct.error) as error:
+        except (struct.error, IndexError, ValueError) as error:
             log.error("Not a valid binary file : %s", error)
 
+        if self.scriptable and self.write_script:
+            self.save_script()
+
+    def save_script(self):
+        """
+        Write the script into a <filename>_sc.txt file, next to the raw file,
+        if this file does not exist yet.
+        """
+        if os.path.isfile(self.filename + "_sc.txt"):
+            return
+        try:
+            with open(self.filename + "_sc.txt", mode="w", encoding='utf_8') as file:
+                log.info("Script file creation...")
+                for line in script_lines(self.text):
+                    file.write(line)
+        except (IOError) as error:
+            log.error("Unable to write script file : %s", error)
+
     def __find_limits(self):
         """
         Find the beginning and the end of signal just after excitation buffer
@@ -111,7 +351,7 @@ class RawDataset(object):
         """
         # if script is available, get limits according excitation length
         if self.scriptable:
-            s = Script(self.filename)
+            s = Script(self.filename, self.text)
             duration = s.get_excit_duration()
             self.start = round(duration / self.step)
             self.end = round(self.points / 2)
@@ -124,32 +364,79 @@ class RawDataset(object):
         """
         Truncate the signal before start to remove excitation
 
-        :param start: first interesting point of signal
+        :param start: first interesting point of signal, in file samples
+        :param end: last interesting point of signal, in file samples
 
         """
         if start < end:
             self.start = start
         if end > 0:
             self.end = end
-        truncated = self.signal[self.start:self.end]
+        # only [read_start:read_end] is in memory
+        if self.start < self.read_start or self.end > self.read_end:
+            log.warning("Truncation (%d, %d) outside of read samples (%d, %d)",
+                        self.start, self.end, self.read_start, self.read_end)
+        first = max(self.start - self.read_start, 0)
+        last = max(self.end - self.read_start, 0)
+        # in mmap mode, only the slice is read and calibrated
+        if self.__signal is None:
+            truncated = self.calibrate(self.samples[first:last])
+        else:
+            truncated = self.signal[first:last]
 
         return truncated
 
+    def iter_blocks(self, block_size=1048576, start=0, end=0):
+        """
+        Yield (offset, block) for successive blocks of calibrated signal,
+        offset being the index of the first sample of block in the file.
+        With mmap=True, only one block at a time is read and converted, so
+        that transients larger than memory can be processed. Once the signal
+        is calibrated or replaced (see signal), the blocks are slices of it.
+
+        :param block_size: number of samples per block
+        :param start: first sample (default : first sample read)
+        :param end: last sample, excluded (default : last sample read)
+
+        :Example:
+
+        >>> raw = RawDataset(filename, mmap=True)
+        >>> total = 0.0
+        >>> for offset, block in raw.iter_blocks(1000000):
+        ...     total += block.sum()
+        """
+        start = max(start, self.read_start)
+        if end <= 0 or end > self.read_end:
+            end = self.read_end
+        for first in range(start, end, block_size):
+            last = min(first + block_size, end)
+            window = slice(first - self.read_start, last - self.read_start)
+            if self.__signal is not None:
+                # signal already calibrated, or replaced (see signal)
+                yield first, self.__signal[window]
+            else:
+                yield first, self.calibrate(self.samples[window])
+
     def hann(self, signal, half=False):
         """
         Apply a Hann windowing on raw signal, before FFT.
+        The window is computed in the precision of signal (float32 or float64).
 
         """
         points = len(signal)
+        dtype = np.float32 if signal.dtype == np.float32 else np.float64
 
         # Hanning from Herschel (half window)"""
         # hann = 0.5 * (1.0 + cos ((PI*i) / channels))"""
         if half:
-            iarr = num.arange(points) * math.pi / points
+            iarr = num.arange(points, dtype=dtype) * dtype(math.pi / points)
             iarr = 0.5 + 0.5 * math.cos(iarr)
         # Hanning from numpy (full window)"""
-        else:
+        elif dtype == np.float64:
             iarr = np.hanning(points)
+        else:
+            iarr = num.arange(points, dtype=dtype) * dtype(2.0 * math.pi / max(points - 1, 1))
+            iarr = 0.5 - 0.5 * math.cos(iarr)
         hann = signal * iarr
 
         return hann
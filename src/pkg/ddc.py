@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Digital down-conversion of PIRENEA signals, before FFT.
+"""
+import logging
+
+from scipy.signal import firwin, upfirdn
+
+import numpy as np
+log = logging.getLogger('root')
+
+
+class DownConverter(object):
+
+    """
+    Shift the band around center_freq (Hz) of a signal to 0 Hz with a complex
+    local oscillator, low-pass filter it and keep one sample out of
+    decimation. The signal is processed block by block (see
+    RawDataset.iter_blocks) : the result is a short complex baseband signal,
+    with a step of stepTime * decimation, covering the band
+    center_freq +/- 0.4 / (stepTime * decimation).
+
+    :Example:
+
+    >>> ddc = DownConverter(raw.step, 255.0e3, decimation=16)
+    >>> for offset, block in raw.iter_blocks(1000000):
+    ...     ddc.process(block, offset)
+    >>> baseband = ddc.baseband()
+    """
+
+    def __init__(self, stepTime=0.0, center_freq=0.0, decimation=16, taps=0):
+        """
+        Constructor
+
+        :param taps: length of the low-pass filter (default : 8 * decimation + 1)
+        """
+        self.stepTime = stepTime
+        self.center_freq = center_freq
+        self.decimation = max(int(decimation), 1)
+        if taps <= 0:
+            taps = 8 * self.decimation + 1
+        # pass band : 80 % of the decimated Nyquist band, unit gain at 0 Hz
+        self.filter = firwin(taps, 0.8 / self.decimation, window='hann')
+        # mixed samples kept for the next block : filter memory, starting at a
+        # multiple of decimation
+        self.history = np.zeros(0, dtype=np.complex128)
+        self.first = None
+        self.position = 0
+        self.blocks = []
+        self.oscillators = {}
+
+    def __oscillator(self, offset, points):
+        """
+        Return the local oscillator for points samples from offset : the
+        oscillator of a block is computed once per block length, then only
+        rotated to the phase of offset.
+        """
+        if points not in self.oscillators:
+            self.oscillators[points] = np.exp(
+                -2j * np.pi * self.center_freq * self.stepTime * np.arange(points))
+        turns = (self.center_freq * self.stepTime * offset) % 1.0
+        return self.oscillators[points] * np.exp(-2j * np.pi * turns)
+
+    def process(self, block, offset):
+        """
+        Down-convert one block of signal : offset is the index in the file of
+        the first sample of block. Blocks must be contiguous.
+        """
+        if self.first is None:
+            self.first = offset
+            self.position = offset
+        elif offset != self.position:
+            log.error("Block at %d is not contiguous (expected %d)", offset, self.position)
+            return
+        mixed = block * self.__oscillator(offset, len(block))
+        # x starts at a multiple of decimation, from the first sample
+        x = np.concatenate((self.history, mixed))
+        start = self.position - len(self.history)
+        self.position += len(block)
+        # polyphase filter : only the samples kept are computed
+        y = upfirdn(self.filter, x, up=1, down=self.decimation)
+        first = -(-len(self.history) // self.decimation)
+        last = -(-len(x) // self.decimation)
+        self.blocks.append(y[first:last])
+        keep = max(self.position - (len(self.filter) - 1) - self.first, 0)
+        keep = self.first + (keep // self.decimation) * self.decimation
+        self.history = x[max(keep, start) - start:]
+
+    def baseband(self):
+        """
+        Return the complex baseband signal of all the blocks processed.
+        """
+        if not self.blocks:
+            return np.zeros(0, dtype=np.complex128)
+        return np.concatenate(self.blocks)
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+FFT backends for the frequency spectra of PIRENEA signals.
+"""
+import logging
+import os
+
+from scipy import fft
+
+import numpy as np
+log = logging.getLogger('root')
+
+
+class NumpyFFT(object):
+
+    """
+    Real FFT with numpy (single thread, double precision).
+
+    With fast_len=True, signals are zero-padded up to the next length that
+    the FFT processes quickly (only factors 2, 3, 5...): lengths with a
+    large prime factor, such as 5240000 = 2^6 * 5^4 * 131, are then avoided.
+    """
+    name = "numpy"
+
+    def __init__(self, fast_len=False):
+        """
+        Constructor
+        """
+        self.fast_len = fast_len
+        # FFT length chosen for each signal length
+        self.lengths = {}
+
+    def length(self, n):
+        """
+        Return the FFT length used for a signal of n points.
+        """
+        if not self.fast_len:
+            return n
+        if n not in self.lengths:
+            self.lengths[n] = fft.next_fast_len(n, real=True)
+            log.debug("FFT length for %d points : %d", n, self.lengths[n])
+        return self.lengths[n]
+
+    def rfft(self, signal, n):
+        """
+        Return the one side FFT of signal, zero-padded to n points.
+        """
+        return np.fft.rfft(signal, n)
+
+    def rfftfreq(self, n, step):
+        return np.fft.rfftfreq(n, step)
+
+    def fft(self, signal, n, overwrite=False):
+        """
+        Return the FFT of a complex signal, zero-padded to n points.
+        With overwrite=True, the FFT may be computed in the memory of signal
+        (not with numpy).
+        """
+        return np.fft.fft(signal, n)
+
+    def fftfreq(self, n, step):
+        return np.fft.fftfreq(n, step)
+
+
+class ScipyFFT(NumpyFFT):
+
+    """
+    Real FFT with scipy.fft, on several threads (workers=-1 : all cores).
+    Threads are used for several signals at once (2-D input, one signal per
+    row) : a single 1-D FFT stays on one core.
+    Single precision signals give single precision (complex64) spectra.
+    """
+    name = "scipy"
+
+    def __init__(self, fast_len=False, workers=-1):
+        """
+        Constructor
+        """
+        super(ScipyFFT, self).__init__(fast_len)
+        self.workers = workers
+
+    def rfft(self, signal, n):
+        return fft.rfft(signal, n, workers=self.workers)
+
+    def rfftfreq(self, n, step):
+        return fft.rfftfreq(n, step)
+
+    def fft(self, signal, n, overwrite=False):
+        return fft.fft(signal, n, overwrite_x=overwrite, workers=self.workers)
+
+    def fftfreq(self, n, step):
+        return fft.fftfreq(n, step)
+
+
+def get_backend(name="numpy", fast_len=False, workers=-1):
+    """
+    Return an FFT backend by name : "numpy" or "scipy".
+    """
+    if name == "scipy":
+        return ScipyFFT(fast_len, workers)
+    if name != "numpy":
+        log.error("Unknown FFT backend : %s, numpy is used", name)
+    return NumpyFFT(fast_len)
+
+
+if __name__ == '__main__':
+
+    """
+    main method to compare the backends on awkward lengths.
+    """
+    import time
+
+    for points in (1000000, 5240000):
+        signal = np.random.randn(points)
+        for backend in (get_backend("numpy"), get_backend("scipy", workers=os.cpu_count()),
+                        get_backend("scipy", fast_len=True, workers=os.cpu_count())):
+            n = backend.length(points)
+            t = time.time()
+            backend.rfft(signal, n)
+            print("{:8d} points, {:6s} (fast_len={!s:5}, n={:d}) : {:.3f} s".format(
+                points, backend.name, backend.fast_len, n, time.time() - t))
+
+else:
+    log.info("Importing... %s", __name__)
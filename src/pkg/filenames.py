@@ -191,6 +191,25 @@ class FilesAndDirs(object):
 
         return accums
 
+    def get_accum_files(self, directory, setup, specNum, acquis):
+        """
+        Return the full names of the accumulations of one acquisition
+        """
+        dirname = directory
+        filenames = []
+
+        if not os.path.isdir(dirname):
+            log.error("Not a directory: %s", dirname)
+        else:
+            self.files = os.listdir(dirname)
+            for f in self.files:
+                if len(f) == 21:
+                    if (f[0:2] == (setup) and f[14:17] == (specNum) and f[18:19] == (acquis)):
+                        filenames.append(os.path.join(dirname, f))
+            filenames.sort()
+
+        return filenames
+
     def get_spectrumName(self, directory, year, month, day, setup, specNum, acquis, accum):
         """
         Return a spectrum name from a given directory, number, acquis, accum
@@ -235,6 +254,8 @@ if __name__ == '__main__':
     print("acquis=", acquis)
     accums = fi.get_accums(dirname, str("P1"), str("001"), str("A"))
     print("accums=", accums)
+    accum_files = fi.get_accum_files(dirname, str("P1"), str("001"), str("A"))
+    print("accum files=", accum_files)
     specName = fi.get_spectrumName(dirname,
                                    int("2018"),
                                    int("01"),
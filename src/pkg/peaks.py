@@ -12,6 +12,8 @@ Picked up from internet.
 import logging
 
 import numpy as np
+from pkg.profiling import profiled
+from pkg.spectrum import mass_window, mass_windows
 log = logging.getLogger('root')
 
 
@@ -21,13 +23,18 @@ class Peaks(object):
     classdocs
     """
 
-    def __init__(self, x=[], y=[]):
+    def __init__(self, x=[], y=[], profiler=None):
         """
         Constructor
+
+        :param profiler: a pkg.profiling.Profiler, to record the
+                         "detect_peaks" and "masstab" stages (masstab_arrays)
         """
         self.x = x
         self.y = y
+        self.profiler = profiler
 
+    @profiled("detect_peaks")
     def detect_peaks(self, x, mph=None, mpd=1, threshold=0, edge='rising',
                      kpsh=False, valley=False, show=False):
         """Detect peaks in data based on their amplitude and other features.
@@ -148,16 +155,9 @@ class Peaks(object):
         # detect small peaks closer than minimum peak distance
         if ind.size and mpd > 1:
             ind = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
-            idel = np.zeros(ind.size, dtype=bool)
-            for i in range(ind.size):
-                if not idel[i]:
-                    # keep peaks with the same height if kpsh is True
-                    idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
-                        & (x[ind[i]] > x[ind] if kpsh else True)
-                    idel[i] = 0  # Keep current peak
-            # remove the small peaks and sort back the indices by their
+            # remove the small peaks, indices are sorted back by their
             # occurrence
-            ind = np.sort(ind[~idel])
+            ind = self.__suppress_close(x, ind, mpd, kpsh)
 
         if show:
             if indnan.size:
@@ -168,21 +168,100 @@ class Peaks(object):
 
         return ind
 
+    @staticmethod
+    def __suppress_close(x, ind, mpd, kpsh):
+        """
+        Return the peaks of ind (sorted by decreasing height) that are not
+        closer than mpd to a higher peak kept, sorted by position.
+        The bounds of the mpd neighbourhood of each peak are found once for
+        all, by binary search on the peaks sorted by position; then each peak
+        kept, in order of height, removes its neighbours with one slice of a
+        boolean array : O(k log k + k * mpd) for k peaks, instead of one pass
+        over all the peaks per peak kept.
+        """
+        position = np.sort(ind)
+        height = x[position]
+        first = np.searchsorted(position, position - mpd, side='left').tolist()
+        last = np.searchsorted(position, position + mpd, side='right').tolist()
+        removed = np.zeros(len(position), dtype=bool)
+        for i in np.searchsorted(position, ind).tolist():
+            if removed[i]:
+                continue
+            window = slice(first[i], last[i])
+            if kpsh:
+                # keep peaks with the same height
+                removed[window] |= height[window] < height[i]
+            else:
+                removed[window] = True
+                removed[i] = False
+        return position[~removed]
+
     def prepare_detect(self, ref, accuracy, xx, yy, startx, endx):
         # search values to detect peaks around a central value
         m = ref
         a = accuracy
         x = np.asarray(xx)
         y = np.asarray(yy)
-        mask1 = [(x >= m) & (x <= m + a)]
+        window1 = mass_window(x, m, m + a)
         # Minimum peak distance (to avoid edge peaks of same peak)
-        mpd = len(x[mask1]) / 1.5
-        # create a mask for start to end values
-        mask = [(x >= (startx)) & (x <= (endx))]
+        mpd = (window1.stop - window1.start) / 1.5
+        # slice of start to end values
+        window = mass_window(x, startx, endx)
         # minimum peak height (to avoid peaks of noise)
-        mph = np.max(y[mask]) / 50.0
+        mph = np.max(y[window]) / 50.0
 
-        return mph, mpd, mask
+        return mph, mpd, window
+
+    def centroid(self, xx, yy, ind, method="gaussian"):
+        """
+        Refine peaks ind of yy between the bins, with the points around each
+        peak : a parabola through yy ("parabolic"), or through log(yy)
+        ("gaussian", exact for a gaussian peak).
+        Return (position, height, fwhm) arrays of the shape of ind : position
+        and fwhm are in units of xx (quadratic interpolation of xx, which may
+        be a non-linear axis such as masses), height in units of yy.
+        yy may be a (files, bins) matrix, with ind (files, peaks).
+        A peak on the first or last bin is not refined.
+        """
+        x = np.asarray(xx, dtype=np.float64)
+        y = np.asarray(yy)
+        ind = np.asarray(ind, dtype=np.intp)
+        last = y.shape[-1] - 1
+        if last < 2:
+            return x[ind], np.take_along_axis(y, ind, axis=-1), np.full(ind.shape, np.nan)
+        inside = (ind > 0) & (ind < last)
+        left = np.take_along_axis(y, np.clip(ind - 1, 0, last), axis=-1).astype(np.float64)
+        center = np.take_along_axis(y, np.clip(ind, 0, last), axis=-1).astype(np.float64)
+        right = np.take_along_axis(y, np.clip(ind + 1, 0, last), axis=-1).astype(np.float64)
+        value = center
+        if method == "gaussian":
+            tiny = np.finfo(np.float64).tiny
+            left, center, right = (np.log(np.maximum(v, tiny)) for v in (left, center, right))
+        elif method != "parabolic":
+            raise ValueError("Unknown centroid method : {}".format(method))
+        # second difference : negative at a maximum
+        curve = left - 2 * center + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(inside & (curve < 0), 0.5 * (left - right) / curve, 0.0)
+            delta = np.clip(delta, -0.5, 0.5)
+            height = center - 0.25 * (left - right) * delta
+            if method == "gaussian":
+                # log(y) = log(height) - (i - delta)^2 / (2 * sigma^2)
+                width = 2 * np.sqrt(2 * np.log(2) / -curve)
+                height = np.exp(height)
+            else:
+                # y = height + curve / 2 * (i - delta)^2
+                width = 2 * np.sqrt(height / -curve)
+        height = np.where(inside, height, value)
+        width = np.where(inside & (curve < 0), width, np.nan)
+        # quadratic interpolation of the axis around each peak
+        i = np.clip(ind, 1, last - 1)
+        x0, slope, bend = x[i], (x[i + 1] - x[i - 1]) / 2, (x[i + 1] - 2 * x[i] + x[i - 1]) / 2
+        shift = np.where(inside, ind - i + delta, 0.0)
+        position = np.where(inside, x0 + slope * shift + bend * shift ** 2,
+                            x[np.clip(ind, 0, last)])
+        fwhm = width * np.abs(slope + 2 * bend * shift)
+        return position, height, fwhm
 
 #     def masstab_peaks(self, xx, yy, ind_list, accuracy=0.2):
 #         res = {}
@@ -191,35 +270,70 @@ class Peaks(object):
 #         a = accuracy
 #         for dummy, index in enumerate(ind_list):
 #             m = float(index)
-#             mask = [(x >= m - a) & (x <= m + a)]
-#             if len(y[mask]) > 0:
-#                 peak = max(y[mask])
+#             window = mass_window(x, m - a, m + a)
+#             if len(y[window]) > 0:
+#                 peak = max(y[window])
 #                 res[index] = peak
 #             else:
 #                 res[index] = 0.0
 #         return res
 
-    def masstab_peaks(self, xx, yy, ind_list, accuracy=0.2):
-        res_m = {}
-        res_i = {}
+    def masstab_peaks(self, xx, yy, ind_list, accuracy=0.2, centroid=None):
+        """
+        Return two dicts, mass and intensity of the highest point around each
+        mass of ind_list (see masstab_arrays), keyed by the items of ind_list.
+        """
+        mass, intensity = self.masstab_arrays(xx, yy, [float(index) for index in ind_list],
+                                              accuracy, centroid=centroid)
+        res_m = dict(zip(ind_list, mass.tolist()))
+        res_i = dict(zip(ind_list, intensity.tolist()))
+
+        return res_m, res_i
+
+    @profiled("masstab")
+    def masstab_arrays(self, xx, yy, masses, accuracy=0.2, max_items=16777216, centroid=None):
+        """
+        Return (mass, intensity) of the highest point of yy within accuracy
+        of each mass of masses : arrays (masses,) for one spectrum, or
+        (files, masses) for a (files, bins) matrix of spectra sharing the mass
+        axis xx. Mass and intensity are 0.0 if no point is within accuracy.
+
+        The windows of all the masses are found at once by binary search on
+        the monotonic mass axis, then their points are gathered into a
+        (files, masses, width) array whose argmax gives all the peaks;
+        spectra are gathered by chunks of at most max_items points.
+        With centroid ("parabolic" or "gaussian"), mass and intensity are
+        interpolated between the bins (see centroid()).
+        """
         x = np.asarray(xx)
         y = np.asarray(yy)
-        a = accuracy
-        for dummy, index in enumerate(ind_list):
-            m = float(index)
-            mask = [(x >= m - a) & (x <= m + a)]
-            # process peaks around a mass value
-            if len(y[mask]) > 0:
-                # find max value = peak
-                peak = max(y[mask])
-                # find exact mass corresponding to the peak
-                val = [i for i, j in enumerate(y[mask]) if j == peak]
-                res_m[index] = x[mask][val]
-                res_i[index] = y[mask][val]
-            else:
-                res_m[index] = 0.0
-                res_i[index] = 0.0
-
+        rows = y.reshape(-1, y.shape[-1])
+        masses = np.asarray(masses, dtype=np.float64)
+        first, last = mass_windows(x, masses - accuracy, masses + accuracy)
+        size = np.maximum(last - first, 0)
+        res_m = np.zeros((len(rows), len(masses)))
+        res_i = np.zeros((len(rows), len(masses)))
+        width = int(size.max()) if size.size else 0
+        if width > 0:
+            index = np.minimum(first[:, np.newaxis] + np.arange(width), len(x) - 1)
+            outside = np.arange(width) >= size[:, np.newaxis]
+            chunk = max(max_items // index.size, 1)
+            for start in range(0, len(rows), chunk):
+                values = rows[start:start + chunk][:, index]
+                values[:, outside] = -np.inf
+                best = np.argmax(values, axis=-1)
+                peak = index[np.arange(len(masses)), best]
+                if centroid:
+                    res_m[start:start + chunk], res_i[start:start + chunk], dummy = \
+                        self.centroid(x, rows[start:start + chunk], peak, centroid)
+                else:
+                    res_m[start:start + chunk] = x[peak]
+                    res_i[start:start + chunk] = np.take_along_axis(
+                        values, best[..., np.newaxis], axis=-1)[..., 0]
+            res_m[:, size == 0] = 0.0
+            res_i[:, size == 0] = 0.0
+        if y.ndim == 1:
+            return res_m[0], res_i[0]
         return res_m, res_i
 
 
@@ -260,7 +374,7 @@ if __name__ == '__main__':
     accuracy = 1.0
     p = Peaks()
 
-    mph, mpd, mask = p.prepare_detect(ref_mass, accuracy, x, y, startx, endx)
+    mph, mpd, window = p.prepare_detect(ref_mass, accuracy, x, y, startx, endx)
     # Detect peak on rising edge
     edge = 'rising'
     # Detect peak greater than threshold
@@ -268,19 +382,19 @@ if __name__ == '__main__':
     # Adjust mph to detect more or less peaks
     mph = mph * 3.0
 
-    ind = p.detect_peaks(y[mask], mph, mpd, threshold, edge)
+    ind = p.detect_peaks(y[window], mph, mpd, threshold, edge)
 
     fig, ax = plt.subplots(1, 1)
-    line1, = ax.plot(x[mask], y[mask], 'b', lw=1)
+    line1, = ax.plot(x[window], y[window], 'b', lw=1)
 
     line2, = ax.plot(
-        x[mask][ind], y[mask][ind], '+', mfc=None, mec='r', mew=2, ms=8)
+        x[window][ind], y[window][ind], '+', mfc=None, mec='r', mew=2, ms=8)
 
     ax.set_title("%s (mph=%.3f, mpd=%d, threshold=%s, edge='%s')"
                  % ('Peak detection', mph, mpd, str(threshold), edge))
     # test annotations
-    x = x[mask][ind]
-    y = y[mask][ind]
+    x = x[window][ind]
+    y = y[window][ind]
     for i, j in zip(x, y):
         text = "{:.3f}".format(float(j)) + " (" + \
             "{:.4f}".format(float(i)) + ")"
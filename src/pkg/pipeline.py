@@ -9,36 +9,122 @@ Process PIRENEA data.
 """
 import logging
 import numpy as np
-from pkg.dataset import RawDataset
+from pkg.cache import file_identity
+from pkg.dataset import RawDataset, hann_window
+from pkg.ddc import DownConverter
+from pkg.fft import get_backend
 from pkg.peaks import Peaks
+from pkg.profiling import profile
 from pkg.script import Script
+from pkg.spectrum import Calibration
 from pkg.spectrum import FrequencySpectrum
+from pkg.spectrum import MassCalibrator
 from pkg.spectrum import MassSpectrum
+from pkg.spectrum import ZoomSpectrum
 log = logging.getLogger('root')
 
 
 class Pipeline(object):
 
     """
-    classdocs
+    Process a PIRENEA file in stages : load (constructor, coadd), signal
+    (process_signal or process_downconvert), spectrum (FFT, or
+    process_zoom), mass, calibration (mass_recalibrate) and peaks.
+    Each stage remembers the parameters of its last run : called again with
+    the same parameters, it does nothing. A stage run with new parameters
+    invalidates the stages after it, so that changing the peak height only
+    redoes the peak detection, and changing the calibration keeps the FFT.
+
+    :Example:
+
+    >>> pip = Pipeline(filename)
+    >>> pip.process_signal(pip.start, pip.end)
+    >>> pip.process_spectrum(1000.0, 300.0939, 255.692e3, 0.001e3)
+    >>> pip.process_peaks(0.02, 20, 290.0, 310.0)
+    >>> pip.process_spectrum(1000.0, 300.0939, 255.700e3, 0.001e3)  # no FFT
+
+    With a profiler (see pkg.profiling), each stage processed is recorded,
+    with the stages of RawDataset ("read"), FrequencySpectrum ("fft") and
+    Peaks within it.
     """
 
-    def __init__(self, filename=""):
+    STAGES = ("load", "signal", "spectrum", "mass", "calibration", "peaks")
+
+    def __init__(self, filename="", mmap=False, start=0, end=0, dtype=np.float64,
+                 cache=None, buffer=None, spectrum_cache=None, fft_backend=None, profiler=None):
         """
         Constructor
+
+        :param mmap: map the raw file instead of reading it (see RawDataset)
+        :param start: first sample to read, also the default start of signal
+        :param end: last sample to read, also the default end of signal
+                    (0 = read the whole file)
+        :param dtype: np.float64, or np.float32 to process signal, window and
+                      FFT in single precision
+        :param cache: a DatasetCache for the raw files (see RawDataset)
+        :param buffer: bytes of the file, already read (see pkg.prefetch)
+        :param spectrum_cache: a SpectrumCache : spectra already computed with
+                               the same file and parameters are not recomputed
+        :param fft_backend: an FFT backend of pkg.fft, for example
+                            get_backend("scipy", fast_len=True, workers=-1)
+        :param profiler: a pkg.profiling.Profiler, to record the stages
         """
         self.filename = filename
+        self.mmap = mmap
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+        self.buffer = buffer
+        self.spectrum_cache = spectrum_cache
+        self.fft_backend = fft_backend
+        self.profiler = profiler
+        self.signal_params = ()
+        self.coadded = []
+        self.read_start = start
+        self.read_end = end
+        # parameters of the last run of each stage still valid
+        self.stages = {}
         self.__process_file()
 
+    def __is_done(self, stage, params):
+        """
+        Return True if stage has already been processed with params.
+        Else, forget stage and the stages after it : the caller processes
+        stage, then records params in stages[stage].
+        """
+        if self.stages.get(stage, None) == params:
+            return True
+        self.invalidate(stage)
+        return False
+
+    def invalidate(self, stage="load"):
+        """
+        Forget stage and the stages after it : they are processed again at
+        their next call.
+        """
+        for name in self.STAGES[self.STAGES.index(stage):]:
+            self.stages.pop(name, None)
+
     def __process_file(self):
         """ operations on files """
-        self.raw = RawDataset(self.filename)
+        with profile(self.profiler, "load", self.filename):
+            self.__load()
+        self.invalidate("load")
+        self.stages["load"] = (self.filename, self.read_start, self.read_end)
+
+    def __load(self):
+        self.raw = RawDataset(self.filename, mmap=self.mmap,
+                              start=self.read_start, end=self.read_end,
+                              dtype=self.dtype, cache=self.cache, buffer=self.buffer,
+                              profiler=self.profiler)
         self.step = self.raw.step
         self.points = self.raw.points
+        # step and center frequency of signal[], changed by down-conversion
+        self.signal_step = self.step
+        self.center_freq = 0.0
         self.scr = None
         # if script is available, get limits according excitation length
         if self.raw.scriptable:
-            self.scr = Script(self.filename)
+            self.scr = Script(self.filename, self.raw.text)
             duration = self.scr.get_excit_duration()
             self.start = round(duration / self.step)
             self.end = self.points
@@ -46,34 +132,210 @@ class Pipeline(object):
         else:
             self.start = 0
             self.end = self.points
+        # a range read fixes the limits of signal
+        if self.read_start > 0 or self.read_end > 0:
+            self.start = self.raw.read_start
+            self.end = self.raw.read_end
+
+    def coadd(self, filenames, block_size=1048576):
+        """
+        Replace the raw signal by the mean of the raw signals of filenames,
+        accumulations of the same spectrum (see FilesAndDirs.get_accum_files).
+        Signals are read block by block and summed into one buffer, so that
+        memory does not depend on the number of accumulations.
+        Then, process_signal(), process_spectrum() and process_peaks() work
+        on the co-added signal.
+
+        :param filenames: accumulations to co-add (including, or not, filename)
+        """
+        self.invalidate("signal")
+        with profile(self.profiler, "coadd", self.filename):
+            self.__coadd(filenames, block_size)
+        log.info("%d accumulations co-added", len(self.coadded))
+
+    def __coadd(self, filenames, block_size):
+        total = np.zeros(self.raw.read_end - self.raw.read_start, dtype=self.dtype)
+        self.coadded = []
+        for filename in filenames:
+            raw = RawDataset(filename, mmap=True, start=self.raw.read_start,
+                             end=self.raw.read_end, dtype=self.dtype, cache=self.cache,
+                             profiler=self.profiler)
+            if raw.points != self.points or raw.step != self.step:
+                log.error("Not co-added %s : %d points, step %g s instead of %d points, step %g s",
+                          filename, raw.points, raw.step, self.points, self.step)
+                continue
+            for offset, block in raw.iter_blocks(block_size):
+                first = offset - self.raw.read_start
+                total[first:first + len(block)] += block
+            self.coadded.append(filename)
+        if self.coadded:
+            total /= len(self.coadded)
+            self.raw.signal = total
 
     def process_signal(self, start=0, end=0, hann=False, half=False, zero=False, zero_twice=False):
+        params = (start, end, hann, half, zero, zero_twice)
+        if self.__is_done("signal", params):
+            return
+        with profile(self.profiler, "signal", self.filename):
+            self.__process_signal(start, end, hann, half, zero, zero_twice)
+        self.signal_params = params
+        self.stages["signal"] = params
+
+    def __process_signal(self, start, end, hann, half, zero, zero_twice):
+        self.signal_step = self.step
+        self.center_freq = 0.0
         self.signal = self.raw.truncate(start, end)
         if hann:
             self.signal = self.raw.hann(self.signal, half=False)
         if half:
             self.signal = self.raw.hann(self.signal, half=True)
         if zero:
-            dummy = np.zeros(self.points)
+            dummy = np.zeros(self.points, dtype=self.signal.dtype)
             if (end > self.points):
                 end = self.points
             dummy[0:(end - start)] = self.signal
             self.signal = dummy
         if zero_twice:
-            dummy = np.zeros(self.points * 2)
+            dummy = np.zeros(self.points * 2, dtype=self.signal.dtype)
             if (end > self.points):
                 end = self.points
             dummy[0:(end - start)] = self.signal
             self.signal = dummy
 
+    def process_downconvert(self, start=0, end=0, center_freq=0.0, decimation=16,
+                            hann=False, half=False, block_size=1048576):
+        """
+        Process signal [start:end] block by block, instead of process_signal() :
+        Hann windowing, then down-conversion of the band around center_freq
+        (Hz) and decimation (see pkg.ddc.DownConverter).
+        signal[] is then a short complex baseband signal, and
+        process_spectrum() maps its spectrum back to absolute frequencies and
+        masses (see Calibration.freq to choose center_freq).
+        """
+        params = ("ddc", start, end, center_freq, decimation, hann, half)
+        if self.__is_done("signal", params):
+            return
+        with profile(self.profiler, "signal", self.filename):
+            self.__process_downconvert(start, end, center_freq, decimation, hann, half,
+                                       block_size)
+        self.signal_params = params
+        self.stages["signal"] = params
+
+    def __process_downconvert(self, start, end, center_freq, decimation, hann, half,
+                              block_size):
+        ddc = DownConverter(self.step, center_freq, decimation)
+        start = max(start, self.raw.read_start)
+        if end <= 0 or end > self.raw.read_end:
+            end = self.raw.read_end
+        for offset, block in self.raw.iter_blocks(block_size, start, end):
+            index = offset - start + np.arange(len(block))
+            if hann:
+                block = block * hann_window(index, end - start, False, block.dtype.type)
+            if half:
+                block = block * hann_window(index, end - start, True, block.dtype.type)
+            ddc.process(block, offset)
+        self.signal = ddc.baseband()
+        self.signal_step = self.step * ddc.decimation
+        self.center_freq = center_freq
+
     def process_spectrum(self, factor=1000.0, ref_mass=0.0, cyclo_freq=0.0, mag_freq=0.0):
-        #         t = time.time()
-        fs = FrequencySpectrum(self.signal, self.step)
-#         t1 = time.time() - t
-        self.spectrum = fs.spectrum * factor
-        self.freq = fs.freq  # in Hz
-        ms = MassSpectrum(self.freq, ref_mass, cyclo_freq, mag_freq)
-        self.mass = ms.mass
+        """
+        FFT of signal[] (spectrum stage), then mass axis (see process_mass).
+        """
+        if not self.__is_done("spectrum", (factor,)):
+            with profile(self.profiler, "spectrum", self.filename):
+                self.__process_fft(factor)
+            self.stages["spectrum"] = (factor,)
+        self.process_mass(ref_mass, cyclo_freq, mag_freq)
+
+    def __load_spectrum(self, params):
+        """
+        Load spectrum[] and freq[] of signal[] processed with params from
+        spectrum_cache, if there : spectrum[] is None otherwise.
+        Return the key of the spectrum in spectrum_cache (None without cache).
+        """
+        self.spectrum = None
+        if self.spectrum_cache is None:
+            return None
+        fast_len = self.fft_backend is not None and self.fft_backend.fast_len
+        coadded = tuple(file_identity(filename) for filename in self.coadded)
+        params = self.signal_params + params + (self.dtype.name, fast_len, coadded)
+        key = self.spectrum_cache.spectrum_key(self.filename, params)
+        self.spectrum, self.freq = self.spectrum_cache.load(key)
+        return key
+
+    def __process_fft(self, factor):
+        key = self.__load_spectrum((factor,))
+        if self.spectrum is None:
+            fs = FrequencySpectrum(self.signal, self.signal_step, self.dtype, self.fft_backend,
+                                   self.center_freq, factor, self.profiler)
+            self.spectrum = fs.spectrum
+            self.freq = fs.freq  # in Hz
+            if key is not None:
+                self.spectrum_cache.save(key, self.spectrum, self.freq)
+
+    def process_mass(self, ref_mass=0.0, cyclo_freq=0.0, mag_freq=0.0):
+        """
+        Mass axis of spectrum[] (mass stage), with the calibration law of
+        ref_mass, cyclo_freq and mag_freq.
+        """
+        params = (ref_mass, cyclo_freq, mag_freq)
+        if self.__is_done("mass", params):
+            return
+        with profile(self.profiler, "mass", self.filename):
+            self.ms = MassSpectrum(self.freq, ref_mass, cyclo_freq, mag_freq)
+            self.mass = self.ms.mass
+        self.stages["mass"] = params
+
+    def process_zoom(self, startx=0.0, endx=0.0, points=0, factor=1000.0, ref_mass=0.0,
+                     cyclo_freq=0.0, mag_freq=0.0):
+        """
+        Process only the band of spectrum between the masses startx and endx,
+        with a chirp-z transform, instead of process_spectrum().
+        spectrum[], freq[] and mass[] then cover only this band, and
+        process_peaks() works on it as usual.
+        The band is taken in the baseband signal of process_downconvert(), at
+        its step and around its center frequency : on a full length signal,
+        the chirp-z transform is slower than the full FFT (see ZoomSpectrum),
+        so that process_spectrum() is used instead.
+        The zoom is the spectrum stage, with its own parameters, and is
+        computed in the dtype and with the FFT backend of the pipeline.
+
+        :param points: number of frequencies in the band (default : same
+                       resolution as the full spectrum)
+        """
+        if self.signal_params[:1] != ("ddc",):
+            log.error("No zoom of %s : process_downconvert() first, or process_spectrum()",
+                      self.filename)
+            return
+        params = ("zoom", startx, endx, points, factor, ref_mass, cyclo_freq, mag_freq)
+        if not self.__is_done("spectrum", params):
+            with profile(self.profiler, "spectrum", self.filename):
+                self.__process_zoom(params)
+            self.stages["spectrum"] = params
+        self.process_mass(ref_mass, cyclo_freq, mag_freq)
+
+    def __process_zoom(self, params):
+        key = self.__load_spectrum(params)
+        if self.spectrum is None:
+            dummy, startx, endx, points, factor, ref_mass, cyclo_freq, mag_freq = params
+            cal = Calibration(ref_mass, cyclo_freq, mag_freq)
+            freq1 = cal.freq(max(startx, endx))
+            freq2 = cal.freq(min(startx, endx))
+            zs = ZoomSpectrum(self.signal, self.signal_step, freq1 - self.center_freq,
+                              freq2 - self.center_freq, points, self.dtype, self.fft_backend,
+                              factor, self.profiler)
+            self.spectrum = zs.spectrum
+            self.freq = zs.freq + self.center_freq  # in Hz
+            if key is not None:
+                self.spectrum_cache.save(key, self.spectrum, self.freq)
+
+    def window(self, mass1, mass2):
+        """
+        Return the slice of spectrum[], freq[] and mass[] between mass1 and
+        mass2, after process_spectrum() or process_zoom().
+        """
+        return self.ms.window(mass1, mass2)
 
 #     def get_excit_duration(self):
 #         buffer, excitation = self.scr.get_excit()
@@ -83,39 +345,166 @@ class Pipeline(object):
 #             return 0.0
 
     def mass_recalibrate(self, ref_mass=0.0, accuracy=0.1):
-        # Auto calib
+        """
+        Auto calibration on one or several reference masses (see
+        MassCalibrator), after process_spectrum() : mass[] is updated.
+
+        The fit starts from the law of the mass stage, and a ref_mass of 0.0
+        restores this law.
+
+        :param ref_mass: reference mass, or list of reference masses
+        """
         self.ref_mass = ref_mass
         self.accuracy = accuracy
-        if ref_mass > 0.0:
-            self.ms.basic_recalibrate(self.ref_mass, self.accuracy)
+        refs = np.atleast_1d(ref_mass)
+        params = (tuple(refs.tolist()), accuracy)
+        if self.__is_done("calibration", params):
+            return
+        with profile(self.profiler, "calibration", self.filename):
+            # the law of the mass stage is the starting point of the fit
+            law = Calibration(*self.stages["mass"])
+            if refs.size and np.all(refs > 0.0):
+                cal = MassCalibrator(refs, accuracy)
+                peaks = cal.find_references(self.freq, self.spectrum, law)
+                law = cal.fit(peaks, law)
+            if law.A != self.ms.calibration.A or law.B != self.ms.calibration.B:
+                self.ms.recalibrate(law)
+                self.mass = self.ms.mass
+        self.stages["calibration"] = params
 
-    def process_peaks(self, mph=0.0, mpd=0, startx=0.0, endx=0.0):
+    def process_peaks(self, mph=0.0, mpd=0, startx=0.0, endx=0.0, centroid=None):
+        """
+        Detect the peaks of spectrum[] between the masses startx and endx :
+        ind[] are their bins in the slice peaks_window.
+        peaks_mass[], peaks_height[] and peaks_fwhm[] are interpolated between
+        the bins with centroid ("parabolic" or "gaussian", see
+        Peaks.centroid), instead of zero filling the signal; without
+        centroid, they are the values of the bins (and peaks_fwhm is None).
+        """
+        params = (mph, mpd, startx, endx, centroid)
+        if self.__is_done("peaks", params):
+            return
+        with profile(self.profiler, "peaks", self.filename):
+            self.__process_peaks(mph, mpd, startx, endx, centroid)
+        self.stages["peaks"] = params
 
+    def __process_peaks(self, mph, mpd, startx, endx, centroid):
         if mph > 0:
             self.mph = mph
         if mpd > 0:
             self.mpd = mpd
         x = self.mass
         y = self.spectrum
-        p = Peaks()
+        p = Peaks(profiler=self.profiler)
         ref = startx + (abs(endx - startx) / 2)
         delta = 1.0
 
-        mph, mpd, mask = p.prepare_detect(ref, delta, x, y, startx, endx)
+        mph, mpd, window = p.prepare_detect(ref, delta, x, y, startx, endx)
 
         # Detect peak on rising edge
         edge = 'rising'
         # Detect peak greater than threshold
         threshold = 0.0
         # Don't use default plot
-        ind = p.detect_peaks(y[mask], self.mph, self.mpd, threshold, edge)
-#             print("mass =", x[mask][ind])
-#             print("inten=", y[mask][ind])
+        ind = p.detect_peaks(y[window], self.mph, self.mpd, threshold, edge)
+#             print("mass =", x[window][ind])
+#             print("inten=", y[window][ind])
 
         self.mph = mph
         self.mpd = mpd
-        self.mask = mask
+        self.peaks_window = window
         self.ind = ind
+        if centroid:
+            self.peaks_mass, self.peaks_height, self.peaks_fwhm = \
+                p.centroid(x[window], y[window], ind, centroid)
+        else:
+            self.peaks_mass = x[window][ind]
+            self.peaks_height = y[window][ind]
+            self.peaks_fwhm = None
+
+
+class BatchPipeline(object):
+
+    """
+    Process the accumulations of one spectrum (for example .A00 to .A09) at
+    once : their truncated signals, of equal length, are stacked in a
+    (files, points) array and transformed by one row-wise FFT. The mass axis
+    is computed once and shared by all the spectra.
+
+    :Example:
+
+    >>> bat = BatchPipeline(filename_list)
+    >>> bat.process_signal(10000, 1010000)
+    >>> bat.process_spectrum(1000.0, 300.0939, 255.692e3, 0.001e3)
+    >>> bat.spectra.shape  # (files, freq)
+    """
+
+    def __init__(self, filenames=[], mmap=False, dtype=np.float64, cache=None, fft_backend=None):
+        """
+        Constructor
+
+        :param fft_backend: an FFT backend of pkg.fft (default : scipy, on
+                            all cores)
+        """
+        self.filenames = list(filenames)
+        self.mmap = mmap
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+        self.fft_backend = fft_backend
+        if self.fft_backend is None:
+            self.fft_backend = get_backend("scipy")
+        self.step = 0.0
+
+    def process_signal(self, start=0, end=0, hann=False, half=False, zero=False, zero_twice=False):
+        """
+        Read [start:end] of each file and process its signal as
+        Pipeline.process_signal() does, into one row of signals[].
+        Files whose signal has not the length of the first one are skipped:
+        filenames[] is updated with the files kept.
+        """
+        kept = []
+        self.signals = None
+        for filename in self.filenames:
+            pip = Pipeline(filename, mmap=self.mmap, start=start, end=end,
+                           dtype=self.dtype, cache=self.cache)
+            pip.process_signal(start, end, hann, half, zero, zero_twice)
+            if self.signals is None:
+                self.step = pip.step
+                self.signals = np.zeros((len(self.filenames), len(pip.signal)),
+                                        dtype=pip.signal.dtype)
+            elif len(pip.signal) != self.signals.shape[1] or pip.step != self.step:
+                log.error("Skipped %s : %d points, step %g s instead of %d points, step %g s",
+                          filename, len(pip.signal), pip.step, self.signals.shape[1], self.step)
+                continue
+            self.signals[len(kept)] = pip.signal
+            kept.append(filename)
+        self.filenames = kept
+        if self.signals is not None:
+            self.signals = self.signals[:len(kept)]
+
+    def process_spectrum(self, factor=1000.0, ref_mass=0.0, cyclo_freq=0.0, mag_freq=0.0):
+        """
+        Process the spectra of all the signals at once : spectra[] has one
+        spectrum per file, freq[] and mass[] are shared.
+        """
+        fs = FrequencySpectrum(self.signals, self.step, self.dtype, self.fft_backend,
+                               factor=factor)
+        self.spectra = fs.spectrum
+        self.freq = fs.freq  # in Hz
+        self.ms = MassSpectrum(self.freq, ref_mass, cyclo_freq, mag_freq)
+        self.mass = self.ms.mass
+
+    def mass_recalibrate(self, ref_masses=[], accuracy=0.1):
+        """
+        Fit one calibration law per spectrum on reference masses (see
+        MassCalibrator), for all the spectra at once.
+        calibration has then A and B of shape (files, 1), and masses[] one
+        mass axis per spectrum (files, freq).
+        """
+        cal = MassCalibrator(ref_masses, accuracy)
+        peaks = cal.find_references(self.freq, self.spectra, self.ms.calibration)
+        self.calibration = cal.fit(peaks, self.ms.calibration)
+        self.masses = self.calibration.mass(self.freq)
 
 
 if __name__ == '__main__':
@@ -130,23 +519,23 @@ if __name__ == '__main__':
     pip.process_spectrum(factor=1000.0, ref_mass=300.0939, cyclo_freq=255.692e3, mag_freq=0.001e3)
     pip.process_peaks(mph=0.02, mpd=20.0, startx=290.0, endx=310.0)
 
-    mask = pip.mask
+    window = pip.peaks_window
     ind = pip.ind
 
     x = np.asarray(pip.mass)
     y = np.asarray(pip.spectrum)
 
     fig, ax = plt.subplots(1, 1)
-    line1, = ax.plot(x[mask], y[mask], 'b', lw=1)
+    line1, = ax.plot(x[window], y[window], 'b', lw=1)
 
     line2, = ax.plot(
-        x[mask][ind], y[mask][ind], '+', mfc=None, mec='r', mew=2, ms=8)
+        x[window][ind], y[window][ind], '+', mfc=None, mec='r', mew=2, ms=8)
 
     ax.set_title("%s (mph=%.3f, mpd=%d)" % 
                  ('Peak detection', pip.mph, pip.mpd))
     # test annotations
-    x = x[mask][ind]
-    y = y[mask][ind]
+    x = x[window][ind]
+    y = y[window][ind]
     for i, j in zip(x, y):
         text = "{:.3f}".format(float(j)) + " (" + \
             "{:.4f}".format(float(i)) + ")"
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Read PIRENEA files in background threads, ahead of their processing.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
+import os.path
+import time
+
+log = logging.getLogger('root')
+
+
+class PrefetchedFile(object):
+
+    """
+    Content of one PIRENEA file : bytes of the raw file (samples and script)
+    and of its .xml file (None if there is no .xml file, or if it is not
+    read : see ReadAhead).
+    data is None if the raw file could not be read.
+    """
+    __slots__ = ('filename', 'data', 'xml')
+
+    def __init__(self, filename, data=None, xml=None):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self.data = data
+        self.xml = xml
+
+
+class ReadAhead(object):
+
+    """
+    Iterate over a list of PIRENEA files, while the next files are read by a
+    pool of threads. At most depth files are read ahead. Statistics of the
+    read-ahead are logged by report(), after the loop.
+
+    :Example:
+
+    >>> from pkg.prefetch import ReadAhead
+    >>> from pkg.pipeline import Pipeline
+    >>> reader = ReadAhead(filename_list, depth=4)
+    >>> for item in reader:
+    ...     pip = Pipeline(item.filename, buffer=item.data)
+    >>> reader.report()
+    """
+
+    def __init__(self, filenames=[], depth=4, workers=2, xml=True):
+        """
+        Constructor
+
+        :param xml: also read the .xml file of each file
+        """
+        self.filenames = list(filenames)
+        self.depth = max(depth, 1)
+        self.workers = max(workers, 1)
+        self.xml = xml
+        # files already read when the next one is asked, for each file
+        self.ready = []
+        # time spent waiting for a file, in seconds
+        self.stall_time = 0.0
+        self.stalls = 0
+
+    def __read(self, filename):
+        """
+        Read the raw file and its .xml file, in a worker thread.
+        """
+        with open(filename, mode="rb") as fir:
+            data = fir.read()
+        xml = None
+        if self.xml and os.path.isfile(filename + ".xml"):
+            with open(filename + ".xml", mode="rb") as fir:
+                xml = fir.read()
+        return PrefetchedFile(filename, data, xml)
+
+    def __iter__(self):
+        queue = collections.deque()
+        names = iter(self.filenames)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for filename in names:
+                queue.append((filename, executor.submit(self.__read, filename)))
+                if len(queue) >= self.depth:
+                    break
+            while queue:
+                filename, future = queue.popleft()
+                self.ready.append(sum(1 for dummy, f in queue if f.done()) + int(future.done()))
+                if not future.done():
+                    t = time.time()
+                    future.exception()
+                    self.stall_time += time.time() - t
+                    self.stalls += 1
+                # keep depth files in the queue
+                for filename_next in names:
+                    queue.append((filename_next, executor.submit(self.__read, filename_next)))
+                    break
+                try:
+                    item = future.result()
+                except (IOError) as error:
+                    log.error("Unable to read : %s", error)
+                    item = PrefetchedFile(filename)
+                yield item
+
+    def report(self):
+        """
+        Log and return statistics : number of files, mean and minimum of the
+        files ready in the queue, number of stalls and stall time.
+        """
+        n = len(self.ready)
+        stats = {"files": n,
+                 "depth": self.depth,
+                 "mean_ready": sum(self.ready) / n if n else 0.0,
+                 "min_ready": min(self.ready) if n else 0,
+                 "stalls": self.stalls,
+                 "stall_time": self.stall_time}
+        log.info("Read-ahead : %(files)d files, %(mean_ready).1f/%(depth)d ready on average, "
+                 "%(stalls)d stalls, %(stall_time).3f s waiting", stats)
+        return stats
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
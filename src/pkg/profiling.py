@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Optional instrumentation of the processing of PIRENEA data : wall time, CPU
+time, bytes read and peak allocation of each stage of each file.
+"""
+import contextlib
+import functools
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+log = logging.getLogger('root')
+
+
+class StageRecord(object):
+
+    """
+    Measures of one stage (see Profiler.stage) : wall and cpu times in
+    seconds, bytes read from the files, and peak_bytes, the highest memory
+    allocated during the stage above what was allocated at its start (None
+    if memory is not traced).
+    """
+    __slots__ = ('stage', 'filename', 'wall', 'cpu', 'bytes_read', 'peak_bytes')
+
+    def __init__(self, stage, filename=""):
+        """
+        Constructor
+        """
+        self.stage = stage
+        self.filename = filename
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.peak_bytes = None
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "StageRecord(%r)" % self.as_dict()
+
+
+class Profiler(object):
+
+    """
+    Collect a StageRecord per stage processed by the objects it is given to
+    (Pipeline, RawDataset, FrequencySpectrum, Peaks : profiler=...).
+    Stages may be nested (the FFT within the spectrum stage) : the times and
+    memory of a stage include those of the stages within it.
+    Peak allocations are measured with tracemalloc, which numpy informs of
+    its arrays : tracing is started by the constructor (memory=True) and
+    stopped by stop(). Before Python 3.9 (no tracemalloc.reset_peak), the
+    peak of a stage below an earlier peak is not known : the memory at its
+    end is recorded instead.
+
+    :Example:
+
+    >>> profiler = Profiler()
+    >>> pip = Pipeline(filename, profiler=profiler)
+    >>> pip.process_signal(pip.start, pip.end)
+    >>> pip.process_spectrum(1000.0, 300.0939, 255.692e3, 0.001e3)
+    >>> profiler.stop()
+    >>> summary(profiler.as_dicts())["spectrum"]["wall_p50"]
+    """
+
+    def __init__(self, memory=True):
+        """
+        Constructor
+
+        :param memory: trace the peak allocation of each stage
+        """
+        self.records = []
+        self.memory = memory
+        self.started = False
+        # [record, traced memory at start, traced peak, peak of tracemalloc at
+        # start] of the stages in progress
+        self.stack = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+
+    def stop(self):
+        """
+        Stop tracing memory, if started by this profiler.
+        """
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    @contextlib.contextmanager
+    def stage(self, name, filename=""):
+        """
+        Measure the block within the context : the StageRecord yielded is
+        added to records at its end (also if an exception is raised), and
+        its bytes_read may be set by the block. A stage within another one
+        has the filename of the outer stage by default, and its bytes_read
+        are added to those of the outer stage.
+        """
+        if not filename and self.stack:
+            filename = self.stack[-1][0].filename
+        record = StageRecord(name, filename)
+        tracing = self.memory and tracemalloc.is_tracing()
+        current = peak = 0
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # tracemalloc.reset_peak() is new in Python 3.9
+            if hasattr(tracemalloc, "reset_peak"):
+                if self.stack:
+                    # keep the peak of the outer stage before the reset
+                    self.stack[-1][2] = max(self.stack[-1][2], peak)
+                tracemalloc.reset_peak()
+                peak = current
+        self.stack.append([record, current, current, peak])
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.process_time() - cpu
+            dummy, current, peak, start_peak = self.stack.pop()
+            if tracing:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                if traced_peak > start_peak:
+                    peak = max(peak, traced_peak)
+                else:
+                    # peak not reset, and not reached again by the stage :
+                    # its memory at the end is a lower bound of its peak
+                    peak = max(peak, traced)
+                record.peak_bytes = peak - current
+            if self.stack:
+                self.stack[-1][0].bytes_read += record.bytes_read
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+            self.records.append(record)
+
+    def as_dicts(self):
+        """
+        Return the records as a list of dict (json and pickle friendly).
+        """
+        return [record.as_dict() for record in self.records]
+
+
+def profile(profiler, name, filename=""):
+    """
+    Return profiler.stage(name, filename), or a context doing nothing (and
+    yielding None) if profiler is None.
+    """
+    if profiler is None:
+        return _no_stage()
+    return profiler.stage(name, filename)
+
+
+@contextlib.contextmanager
+def _no_stage():
+    """
+    Context doing nothing (contextlib.nullcontext is new in Python 3.7).
+    """
+    yield None
+
+
+def profiled(name):
+    """
+    Decorator of the methods recorded as stage name by the profiler
+    attribute of their object (if not None).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with profile(self.profiler, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary(records):
+    """
+    Return the statistics of records (dicts, see Profiler.as_dicts) per
+    stage : {stage: {"count": n, "wall_p50": ..., "wall_p95": ..., "cpu_p50":
+    ..., "bytes_read_p50": ..., "peak_bytes_p95": ...}}, in order of first
+    appearance of the stages.
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+    result = {}
+    for name, items in stages.items():
+        stats = {"count": len(items)}
+        for field in ("wall", "cpu", "bytes_read", "peak_bytes"):
+            values = [item[field] for item in items if item[field] is not None]
+            if not values:
+                continue
+            p50, p95 = np.percentile(values, (50, 95))
+            stats[field + "_p50"] = float(p50)
+            stats[field + "_p95"] = float(p95)
+            stats[field + "_total"] = float(np.sum(values))
+        result[name] = stats
+    return result
+
+
+def summary_lines(stats):
+    """
+    Return a text table of a summary (see summary()), one line per stage.
+    """
+    lines = ["{:14s} {:>6s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s} {:>10s}".format(
+        "stage", "count", "wall p50", "wall p95", "cpu p50", "cpu p95", "read MB", "peak MB")]
+    for name, item in stats.items():
+        lines.append("{:14s} {:6d} {:9.4f} {:9.4f} {:9.4f} {:9.4f} {:10.2f} {:10.2f}".format(
+            name, item["count"], item.get("wall_p50", 0.0), item.get("wall_p95", 0.0),
+            item.get("cpu_p50", 0.0), item.get("cpu_p95", 0.0),
+            item.get("bytes_read_p50", 0.0) / 1024 ** 2,
+            item.get("peak_bytes_p95", 0.0) / 1024 ** 2))
+    return lines
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
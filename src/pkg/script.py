@@ -12,6 +12,23 @@ import os.path
 log = logging.getLogger("root")
 
 
+def script_lines(text):
+    """
+    Filter the lines of a script : remove empty lines and comments.
+
+    :param text: list of lines, as bytes (read from a PIRENEA file) or str
+    """
+    lines = []
+    for line in text:
+        # strip removes all whitespace characters
+        if line.strip():
+            if isinstance(line, bytes):
+                line = line.decode('utf_8')
+            if line[0] != '/':
+                lines.append(line)
+    return lines
+
+
 class Script(object):
 
     """
@@ -19,11 +36,17 @@ class Script(object):
     Extract useful parameters and fill an XML file with them
     """
 
-    def __init__(self, filename=""):
+    def __init__(self, filename="", text=None):
         """
         Constructor
+
+        :param filename: name of the PIRENEA file (used to select the detection)
+        :param text: script text as read by RawDataset (str, bytes or a list of
+                     bytes lines). If None, the script is read from the
+                     <filename>_sc.txt file written by RawDataset.
         """
         self.filename = filename
+        self.text = text
         self.excitBuffer = []
         self.excitation = []
         self.ejectBuffer = []
@@ -34,6 +57,22 @@ class Script(object):
 
         self.__find_buffers()
 
+    def __script_lines(self):
+        """
+        Return the useful lines of the script (no empty lines, no comments),
+        or None if there is no script.
+        """
+        if self.text is None:
+            # Read txt file, if it has been previously created by a RawDataset
+            if not os.path.isfile(self.filename + "_sc.txt"):
+                return None
+            with open(self.filename + "_sc.txt", mode='rt', encoding='utf_8') as file:
+                return file.readlines()
+        text = self.text
+        if isinstance(text, (str, bytes, bytearray)):
+            text = text.splitlines(True)
+        return script_lines(text)
+
     def __find_buffers(self):
         """
         Retrieve excitation buffers from script file within a tuple
@@ -44,85 +83,83 @@ class Script(object):
         excit = []
         eject = []
 
-        # Read txt file, if it has been previously created by a Dataset.read()
-        # """
-        if os.path.isfile(self.filename + "_sc.txt"):
-            with open(self.filename + "_sc.txt", mode='rt', encoding='utf_8') as file:
-                for line in file:
-                    linew = line.split()
-                    # find all buffers eject/excit
-                    if line[0] == 'B' and len(linew) > 1:
-                        buffers.append(line.split())
-                        if ("eject" in line) or ("elect" in line):
-                            ejectbuf.append(line.split())
-                        else:
-                            excitbuf.append(line.split())
-                    # find the buffers used during the sequence
-                    if len(linew) > 1 and linew[1] == "Detect":
-                        self.detectBuffer.append(linew[2])
-                        excit.append(linew[2])
-
-                    if len(linew) > 1 and linew[1] == "Excit":
-                        eject.append(linew[2])
-
-                """Manage multiple detects in one sequence"""
-                if self.filename.find('A0') > 0 and len(self.detectBuffer) > 0:
-                    self.detection = self.detectBuffer[0]
-                    self.excitation = excit[0]
-                if self.filename.find('B0') > 0 and len(self.detectBuffer) > 1:
-                    self.detection = self.detectBuffer[1]
-                    self.excitation = excit[1]
-                if self.filename.find('C0') > 0 and len(self.detectBuffer) > 2:
-                    self.detection = self.detectBuffer[2]
-                    self.excitation = excit[2]
-                if self.filename.find('D0') > 0 and len(self.detectBuffer) > 3:
-                    self.detection = self.detectBuffer[3]
-                    self.excitation = excit[3]
-                if self.filename.find('E0') > 0 and len(self.detectBuffer) > 4:
-                    self.detection = self.detectBuffer[4]
-                    self.excitation = excit[4]
-                if self.filename.find('F0') > 0 and len(self.detectBuffer) > 5:
-                    self.detection = self.detectBuffer[5]
-                    self.excitation = excit[5]
-                if self.filename.find('G0') > 0 and len(self.detectBuffer) > 6:
-                    self.detection = self.detectBuffer[6]
-                    self.excitation = excit[6]
-                if self.filename.find('H0') > 0 and len(self.detectBuffer) > 7:
-                    self.detection = self.detectBuffer[7]
-                    self.excitation = excit[7]
-                if self.filename.find('I0') > 0 and len(self.detectBuffer) > 8:
-                    self.detection = self.detectBuffer[8]
-                    self.excitation = excit[8]
-                if self.filename.find('J0') > 0 and len(self.detectBuffer) > 9:
-                    self.detection = self.detectBuffer[9]
-                    self.excitation = excit[9]
-
+        lines = self.__script_lines()
+        if lines is not None:
+            for line in lines:
+                linew = line.split()
+                # find all buffers eject/excit
+                if line[0] == 'B' and len(linew) > 1:
+                    buffers.append(line.split())
+                    if ("eject" in line) or ("elect" in line):
+                        ejectbuf.append(line.split())
+                    else:
+                        excitbuf.append(line.split())
+                # find the buffers used during the sequence
+                if len(linew) > 1 and linew[1] == "Detect":
+                    self.detectBuffer.append(linew[2])
+                    excit.append(linew[2])
+
+                if len(linew) > 1 and linew[1] == "Excit":
+                    eject.append(linew[2])
+
+            """Manage multiple detects in one sequence"""
+            if self.filename.find('A0') > 0 and len(self.detectBuffer) > 0:
+                self.detection = self.detectBuffer[0]
+                self.excitation = excit[0]
+            if self.filename.find('B0') > 0 and len(self.detectBuffer) > 1:
+                self.detection = self.detectBuffer[1]
+                self.excitation = excit[1]
+            if self.filename.find('C0') > 0 and len(self.detectBuffer) > 2:
+                self.detection = self.detectBuffer[2]
+                self.excitation = excit[2]
+            if self.filename.find('D0') > 0 and len(self.detectBuffer) > 3:
+                self.detection = self.detectBuffer[3]
+                self.excitation = excit[3]
+            if self.filename.find('E0') > 0 and len(self.detectBuffer) > 4:
+                self.detection = self.detectBuffer[4]
+                self.excitation = excit[4]
+            if self.filename.find('F0') > 0 and len(self.detectBuffer) > 5:
+                self.detection = self.detectBuffer[5]
+                self.excitation = excit[5]
+            if self.filename.find('G0') > 0 and len(self.detectBuffer) > 6:
+                self.detection = self.detectBuffer[6]
+                self.excitation = excit[6]
+            if self.filename.find('H0') > 0 and len(self.detectBuffer) > 7:
+                self.detection = self.detectBuffer[7]
+                self.excitation = excit[7]
+            if self.filename.find('I0') > 0 and len(self.detectBuffer) > 8:
+                self.detection = self.detectBuffer[8]
+                self.excitation = excit[8]
+            if self.filename.find('J0') > 0 and len(self.detectBuffer) > 9:
+                self.detection = self.detectBuffer[9]
+                self.excitation = excit[9]
+
+            for buf in buffers:
+                if buf[1] == self.excitation:
+                    self.excitBuffer.append(buf)
+
+            for ejection in eject:
                 for buf in buffers:
-                    if buf[1] == self.excitation:
-                        self.excitBuffer.append(buf)
-
-                for ejection in eject:
-                    for buf in buffers:
-                        if buf[1] == ejection:
-                            self.ejection.append(ejection)
-                            self.ejectBuffer.append(buf)
-
-                for excit in excitbuf:
-                    if excit[1] == self.excitation:
-                        if len(excit) > 2:
-                            self.excitDuration = float(excit[3]) / 1000.0
-                        else:
-                            self.excitDuration = 0.0
-
-                log.debug("excit duration (s) = %s", self.excitDuration)
-                log.debug("all ejections = %s", self.ejectBuffer)
-                log.debug("ejections used = %s", self.ejection)
-                log.debug("all excitations = %s", self.excitBuffer)
-                log.debug("excitation used = %s", self.excitation)
-                log.debug("all detections = %s", self.detectBuffer)
-                log.debug("detection used = %s", self.detection)
+                    if buf[1] == ejection:
+                        self.ejection.append(ejection)
+                        self.ejectBuffer.append(buf)
+
+            for excit in excitbuf:
+                if excit[1] == self.excitation:
+                    if len(excit) > 2:
+                        self.excitDuration = float(excit[3]) / 1000.0
+                    else:
+                        self.excitDuration = 0.0
+
+            log.debug("excit duration (s) = %s", self.excitDuration)
+            log.debug("all ejections = %s", self.ejectBuffer)
+            log.debug("ejections used = %s", self.ejection)
+            log.debug("all excitations = %s", self.excitBuffer)
+            log.debug("excitation used = %s", self.excitation)
+            log.debug("all detections = %s", self.detectBuffer)
+            log.debug("detection used = %s", self.detection)
         else:
-            log.info("Filename does not exist: %s_sc.txt", self.filename)
+            log.info("No script text, and filename does not exist: %s_sc.txt", self.filename)
 
     def get_excit(self):
         return self.excitBuffer, self.excitation
@@ -152,7 +189,7 @@ if __name__ == '__main__':
     filename = "D:\\PIRENEA\\DATA\\2018\\data_2018_07_20\\P1_2018_07_20_025.A00"
     d = RawDataset(filename)
 
-    s = Script(filename)
+    s = Script(filename, d.text)
     excitBuffer, excitation = s.get_excit()
     ejectBuffer, ejection = s.get_eject()
     detectBuffer, detection = s.get_detect()
@@ -7,11 +7,15 @@
 """
 Process mass and frequency spectra on PIRENEA data.
 """
+import copy
 import logging
 import os
 from scipy import constants
+from scipy import fft
 
 import numpy as np
+from pkg.fft import NumpyFFT, ScipyFFT
+from pkg.profiling import profile
 log = logging.getLogger("root")
 
 
@@ -19,36 +23,100 @@ class FrequencySpectrum(object):
 
     """
     Process a Frequency Spectrum from a PIRENEA signal and stepTime in seconds.
+
+    With dtype=np.float32, the FFT is done in single precision (complex64)
+    and spectrum[] is float32; freq[] stays in double precision.
+    backend is an FFT backend of pkg.fft (default : numpy, or scipy for
+    single precision). Amplitudes are normalized by the number of points of
+    signal, also when the backend pads the signal to a fast FFT length.
+    On a 4M points synthetic transient (int16 samples, 3 ions, noise), the
+    single precision spectrum differs from the double precision one by less
+    than 1e-6 of the highest peak, and detected peaks are the same bins
+    (see tests/test_spectrum.py).
     """
 
-    def __init__(self, signal=[], stepTime=0.0):
+    def __init__(self, signal=[], stepTime=0.0, dtype=np.float64, backend=None,
+                 center_freq=0.0, factor=1.0, profiler=None):
         """
         Constructor
+
+        :param center_freq: for a complex baseband signal (see pkg.ddc), the
+                            frequency in Hz shifted to 0 Hz
+        :param factor: scale factor of the amplitudes of spectrum[]
+        :param profiler: a pkg.profiling.Profiler, to record the "fft" stage
         """
-        self.freq = []
-        self.spectrum = []
-        self.powerSpectrum = []
         self.signal = signal
         self.stepTime = stepTime
+        self.dtype = np.dtype(dtype)
+        self.center_freq = center_freq
+        self.factor = factor
+        self.backend = backend
+        self.profiler = profiler
+        if self.backend is None:
+            self.backend = ScipyFFT() if self.dtype == np.float32 else NumpyFFT()
+        # one signal, or one signal per row
+        self.n = np.shape(self.signal)[-1]
+        self.nfft = self.backend.length(self.n)
+        self.__spectrum = None
+        self.__freq = None
+        self.__power = None
+
+    @property
+    def spectrum(self):
+        """
+        Single sided amplitude frequency spectrum of signal(t), multiplied by
+        factor, computed on first use (one spectrum per row for a 2-D signal).
+        """
+        if self.__spectrum is None:
+            with profile(self.profiler, "fft"):
+                self.__calculate_spectrum()
+        return self.__spectrum
 
-        self.__calculate_spectrum()
+    @property
+    def freq(self):
+        """
+        Frequencies of spectrum[] in Hz, computed on first use.
+        """
+        if self.__freq is None:
+            if np.iscomplexobj(self.signal):
+                self.__freq = np.fft.fftshift(self.backend.fftfreq(self.nfft, self.stepTime))
+                self.__freq += self.center_freq
+            else:
+                self.__freq = self.backend.rfftfreq(self.nfft, self.stepTime)
+        return self.__freq
+
+    @property
+    def powerSpectrum(self):
+        """
+        Square of spectrum[], computed on first use.
+        """
+        if self.__power is None:
+            self.__power = np.square(self.spectrum)
+        return self.__power
 
     def __calculate_spectrum(self):
         """
         Process a single sided amplitude frequency spectrum of signal(t).
 
-        Populate spectrum[] with amplitude frequency spectrum of signal(t).
-        Populate freq[] with frequency steps in Hz from stepTime in seconds.
-        :param signal: signal(t)
+        Populate spectrum[] with amplitude frequency spectrum of signal(t):
+        the only array kept is the magnitude of the FFT, scaled in place by
+        factor / n.
+        :param signal: signal(t), or a 2-D array with one signal(t) per row
+                       (spectrum[] has then one spectrum per row)
         :param stepTime: stepTime in seconds
         """
-        n = len(self.signal)
-        """One side spectrum of real part only """
-        y = np.fft.rfft(self.signal) / n
-        f = np.fft.rfftfreq(n, self.stepTime)
-        self.spectrum = np.abs(y)
-        self.freq = f
-        self.powerSpectrum = np.abs(self.spectrum) ** 2
+        if np.iscomplexobj(self.signal):
+            """Two sides spectrum of a complex baseband signal, around center_freq"""
+            signal = np.asarray(self.signal, dtype=np.result_type(self.dtype, np.complex64))
+            y = np.fft.fftshift(self.backend.fft(signal, self.nfft), axes=-1)
+        else:
+            """One side spectrum of real part only """
+            signal = np.asarray(self.signal, dtype=self.dtype)
+            y = self.backend.rfft(signal, self.nfft)
+        spectrum = np.abs(y)
+        del y
+        spectrum *= self.factor / self.n
+        self.__spectrum = spectrum
 
     def write_to_textFile(self, filename=""):
         """
@@ -69,6 +137,339 @@ class FrequencySpectrum(object):
                     file.write(linew)
 
 
+class ZoomSpectrum(object):
+
+    """
+    Process a narrow band Frequency Spectrum, from freq1 to freq2 (Hz), of a
+    PIRENEA signal with stepTime in seconds, with a chirp-z transform.
+    Only points frequencies are evaluated (default : the resolution of the
+    full spectrum, 1 / (n * stepTime)); more points give a finer sampling
+    of the peaks without zero filling.
+    Amplitudes are normalized and multiplied by factor as in
+    FrequencySpectrum, and dtype, backend and profiler are used the same
+    way : the chirp-z transform is a convolution (Bluestein algorithm) done
+    with three FFTs of the backend, in the precision of dtype.
+    These complex FFTs are longer than signal : the zoom is only faster than
+    the full spectrum on a short signal, such as the decimated baseband of
+    a DownConverter (4M points : 1.3 s and 134 MB in single precision,
+    against 0.07 s and 25 MB for FrequencySpectrum).
+    """
+
+    def __init__(self, signal=[], stepTime=0.0, freq1=0.0, freq2=0.0, points=0,
+                 dtype=np.float64, backend=None, factor=1.0, profiler=None):
+        """
+        Constructor
+        """
+        self.signal = signal
+        self.stepTime = stepTime
+        self.freq1 = min(freq1, freq2)
+        self.freq2 = max(freq1, freq2)
+        self.points = points
+        self.dtype = np.dtype(dtype)
+        self.factor = factor
+        self.backend = backend
+        self.profiler = profiler
+        if self.backend is None:
+            self.backend = ScipyFFT() if self.dtype == np.float32 else NumpyFFT()
+
+        with profile(self.profiler, "fft"):
+            self.__calculate_spectrum()
+
+    def __calculate_spectrum(self):
+        """
+        Populate spectrum[] with amplitude spectrum of signal(t) in the band.
+        Populate freq[] with the frequencies of the band in Hz.
+        """
+        n = len(self.signal)
+        if self.points <= 0:
+            self.points = max(int(np.ceil((self.freq2 - self.freq1) * n * self.stepTime)), 1)
+        df = (self.freq2 - self.freq1) / self.points
+        ctype = np.result_type(self.dtype, np.complex64)
+        length = fft.next_fast_len(n + self.points - 1)
+        # k * i = (k^2 + i^2 - (k - i)^2) / 2 : phases of the chirps computed
+        # in double precision, and reduced before cos() and sin()
+        phase = np.arange(max(n, self.points), dtype=np.float64)
+        np.square(phase, out=phase)
+        phase *= df * self.stepTime
+        np.fmod(phase, 2.0, out=phase)
+        phase *= np.pi
+        # kernel of the convolution : exp(1j * phase), wrapped around
+        kernel = np.zeros(length, dtype=ctype)
+        _expi(phase[:self.points], kernel[:self.points])
+        _expi(phase[n - 1:0:-1], kernel[length - n + 1:])
+        # signal * exp(-1j * (phase + shift to freq1)), zero-padded
+        a = np.zeros(length, dtype=ctype)
+        shift = np.arange(n, dtype=np.float64)
+        shift *= self.freq1 * self.stepTime
+        np.fmod(shift, 1.0, out=shift)
+        shift *= 2 * np.pi
+        shift += phase[:n]
+        _expi(shift, a[:n], -1)
+        del shift
+        a[:n] *= self.signal
+        del phase
+        y = self.backend.fft(a, length, overwrite=True)
+        del a
+        y *= self.backend.fft(kernel, length, overwrite=True)
+        del kernel
+        # inverse FFT with the forward FFT of the backend; the conjugate of
+        # the result and its product by the chirp do not change its modulus
+        np.conj(y, out=y)
+        y = self.backend.fft(y, length, overwrite=True)[:self.points]
+        self.spectrum = np.abs(y)
+        self.spectrum *= self.dtype.type(self.factor / (n * length))
+        self.freq = self.freq1 + np.arange(self.points) * df
+
+
+def _expi(phase, out, sign=1):
+    """
+    Write exp(sign * 1j * phase) into the complex array out, without the
+    complex double precision temporary of np.exp() : return out.
+    """
+    np.cos(phase, out=out.real)
+    np.sin(phase, out=out.imag)
+    if sign < 0:
+        np.negative(out.imag, out=out.imag)
+    return out
+
+def mass_window(mass, mass1, mass2):
+    """
+    Return the slice of mass[] between mass1 and mass2 (included), found by
+    binary search : mass[] is monotonic, increasing, or decreasing as the
+    masses of a frequency axis.
+
+    :Example:
+
+    >>> window = mass_window(pip.mass, 290.0, 310.0)
+    >>> y = pip.spectrum[window]
+    """
+    first, last = mass_windows(mass, min(mass1, mass2), max(mass1, mass2))
+    return slice(int(first), int(last))
+
+
+def mass_windows(mass, low, high):
+    """
+    Return (first, last) : arrays of the bounds of the slices of mass[]
+    between low[i] and high[i] (included), all found at once.
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    if len(mass) > 1 and mass[0] > mass[-1]:
+        return _first_below(mass, high, True), _first_below(mass, low, False)
+    return np.searchsorted(mass, low, 'left'), np.searchsorted(mass, high, 'right')
+
+
+def _first_below(mass, values, included):
+    """
+    Return the first indices of the decreasing mass[] where mass is below
+    values (or equal to values if included), len(mass) if there is none.
+    Binary search on all the values at once : np.searchsorted would need a
+    reversed copy of mass[].
+    """
+    n = len(mass)
+    first = np.zeros(np.shape(values), dtype=np.intp)
+    last = np.full(np.shape(values), n, dtype=np.intp)
+    while np.any(first < last):
+        middle = (first + last) // 2
+        m = mass[np.minimum(middle, n - 1)]
+        below = (m < values) | ((m == values) & included)
+        active = first < last
+        last = np.where(active & below, middle, last)
+        first = np.where(active & ~below, middle + 1, first)
+    return first
+
+
+class Calibration(object):
+
+    """
+    Calibration law of PIRENEA : mass = A/nu - B/(nu*nu), with
+    A = refMass * true cyclotron and B = refMass * modified cyclotron * magnetron.
+
+    The mass decreases when the frequency increases above minFreq = 2 * B / A
+    (below minFreq, the mass is maxMass = A * A / (4 * B)) : the law is
+    inverted in closed form, and a mass window of a spectrum is a contiguous
+    slice of its (increasing) frequency axis.
+
+    :Example:
+
+    >>> cal = Calibration(300.0939, 255.692e3, 0.001e3)
+    >>> window = cal.window(pip.freq, 290.0, 310.0)
+    >>> y = pip.spectrum[window]
+    """
+
+    def __init__(self, ref_mass=300.0939, cyclo_freq=255.723e3, mag_freq=0.001e3):
+        """
+        Constructor
+        """
+        self.refMass = ref_mass
+        self.cyclotronFreq = cyclo_freq
+        self.magnetronFreq = mag_freq
+        self.set_law(ref_mass * cyclo_freq, ref_mass * (cyclo_freq - mag_freq) * mag_freq)
+
+    def set_law(self, A, B):
+        """
+        Set the coefficients of the law (see MassCalibrator.fit) : scalars,
+        or arrays of shape (files, 1) for one law per spectrum; mass() then
+        returns one row of masses per law.
+        """
+        self.A = A
+        self.B = B
+        self.maxMass = self.A * self.A / (4 * self.B)
+        self.minFreq = 2 * self.B / self.A
+
+    def mass(self, freq):
+        """
+        Return the mass (u) of freq (Hz), or an array of masses, in one
+        vectorized expression.
+        """
+        freq = np.asarray(freq, dtype=np.float64)
+        if freq.ndim == 0:
+            return self.mass(freq[np.newaxis])[..., 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1.0 / freq
+            mass = self.B * inverse
+            np.subtract(self.A, mass, out=mass)
+            mass *= inverse
+        np.copyto(mass, self.maxMass, where=freq <= self.minFreq)
+        return mass
+
+    def freq(self, mass):
+        """
+        Return the frequency (Hz) of mass (u), or an array of frequencies :
+        mass * nu^2 - A * nu + B = 0, nu being the root above minFreq.
+        """
+        mass = np.asarray(mass, dtype=np.float64)
+        delta = np.maximum(self.A * self.A - 4 * mass * self.B, 0.0)
+        return (self.A + np.sqrt(delta)) / (2 * mass)
+
+    def index(self, freq, mass):
+        """
+        Return the index in the increasing frequency axis freq[] of the first
+        frequency not below the frequency of mass.
+        """
+        return np.searchsorted(freq, self.freq(mass), 'left')
+
+    def window(self, freq, mass1, mass2):
+        """
+        Return the slice of the increasing frequency axis freq[] whose masses
+        are between mass1 and mass2.
+        """
+        first = np.searchsorted(freq, self.freq(max(mass1, mass2)), 'left')
+        last = np.searchsorted(freq, self.freq(min(mass1, mass2)), 'right')
+        return slice(int(first), int(last))
+
+
+class MassCalibrator(object):
+
+    """
+    Fit the calibration law on several reference masses : the highest bin
+    around each reference mass (within accuracy, in u) is refined between
+    the bins (gaussian centroid, see Peaks.centroid) and taken as its peak,
+    then A and B are fitted by least squares on mass = A/nu - B/(nu*nu).
+    Spectra are processed as a (files, freq) matrix : one law is fitted per
+    row, without loop on the files.
+    With a single reference peak, or reference peaks too close to each other
+    to fit B (relative span of 1/nu below min_span), B is kept from the
+    initial calibration and only A is fitted; without reference peak, the
+    initial law is kept.
+
+    :Example:
+
+    >>> cal = MassCalibrator([300.0939, 301.0973, 302.1006], accuracy=0.1)
+    >>> peaks = cal.find_references(bat.freq, bat.spectra, bat.ms.calibration)
+    >>> laws = cal.fit(peaks, bat.ms.calibration)
+    >>> masses = laws.mass(bat.freq)  # (files, freq)
+    """
+
+    def __init__(self, ref_masses=[], accuracy=0.1, min_span=0.05):
+        """
+        Constructor
+
+        :param min_span: smallest relative span of 1/nu, (max - min) / mean,
+                         of the reference peaks to fit B : the B term is only
+                         a few 1e-3 of the mass, so that references 1 u apart
+                         cannot separate it from A
+        """
+        self.ref_masses = np.atleast_1d(np.asarray(ref_masses, dtype=np.float64))
+        self.accuracy = accuracy
+        self.min_span = min_span
+
+    def find_references(self, freq, spectra, calibration):
+        """
+        Return the frequencies of the reference peaks : (refs,) for one
+        spectrum, (files, refs) for a (files, freq) matrix of spectra. The
+        frequency is NaN when the window of a reference mass is empty.
+
+        :param calibration: initial Calibration, used to find the windows
+        """
+        # imported here : pkg.peaks imports this module
+        from pkg.peaks import Peaks
+
+        spectra = np.asarray(spectra)
+        rows = spectra.reshape(-1, spectra.shape[-1])
+        ind = np.zeros((len(rows), len(self.ref_masses)), dtype=np.intp)
+        empty = np.zeros(len(self.ref_masses), dtype=bool)
+        for j, mass in enumerate(self.ref_masses):
+            window = calibration.window(freq, mass - self.accuracy, mass + self.accuracy)
+            if window.stop > window.start:
+                ind[:, j] = window.start + np.argmax(rows[:, window], axis=1)
+            else:
+                empty[j] = True
+        found, dummy, dummy = Peaks().centroid(freq, rows, ind, "gaussian")
+        found[:, empty] = np.nan
+        if spectra.ndim == 1:
+            return found[0]
+        return found
+
+    def fit(self, peak_freq, calibration):
+        """
+        Return a Calibration fitted on the reference peaks : the same law as
+        calibration, with A and B of shape (files, 1) for (files, refs)
+        peak frequencies (scalars for (refs,)).
+
+        Normal equations of the least squares, solved in closed form for all
+        the files at once, on columns scaled by a typical frequency.
+        """
+        peak_freq = np.asarray(peak_freq, dtype=np.float64)
+        rows = np.atleast_2d(peak_freq)
+        valid = ~np.isnan(rows)
+        count = valid.sum(axis=1)
+        # scaled columns : mass = a * u - b * u^2, with u = f0 / nu
+        f0 = calibration.A / np.mean(self.ref_masses)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.where(valid, f0 / rows, 0.0)
+        m = np.where(valid, self.ref_masses, 0.0)
+        with np.errstate(invalid='ignore'):
+            span = (np.nanmax(np.where(valid, u, np.nan), axis=1)
+                    - np.nanmin(np.where(valid, u, np.nan), axis=1)) * count / np.sum(u, axis=1)
+        s11 = np.sum(u * u, axis=1)
+        s12 = -np.sum(u ** 3, axis=1)
+        s22 = np.sum(u ** 4, axis=1)
+        t1 = np.sum(u * m, axis=1)
+        t2 = -np.sum(u * u * m, axis=1)
+        det = s11 * s22 - s12 * s12
+        a = np.full(len(rows), calibration.A / f0)
+        b = np.full(len(rows), calibration.B / f0 ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # several reference peaks, spread enough : a and b
+            many = (count >= 2) & (span >= self.min_span) & (det > 0.0)
+            # one reference peak, or too close peaks : B is kept, least squares on a only
+            one = (count >= 1) & ~many
+            a[one] = (t1[one] - b[one] * s12[one]) / s11[one]
+            a[many] = (s22[many] * t1[many] - s12[many] * t2[many]) / det[many]
+            b[many] = (s11[many] * t2[many] - s12[many] * t1[many]) / det[many]
+        lost = count < 1
+        if np.any(lost):
+            log.warning("No reference peak found in %d spectra : calibration kept",
+                        np.count_nonzero(lost))
+        law = copy.copy(calibration)
+        if peak_freq.ndim == 1:
+            law.set_law(a[0] * f0, b[0] * f0 ** 2)
+        else:
+            law.set_law((a * f0)[:, np.newaxis], (b * f0 ** 2)[:, np.newaxis])
+        return law
+
+
 class MassSpectrum(object):
 
     """
@@ -86,10 +487,10 @@ class MassSpectrum(object):
         N. Bruneleau value : 255.710e3
         """
         self.f = freq
-        self.mass = np.zeros(len(self.f))
         self.refMass = ref_mass
         self.cyclotronFreq = cyclo_freq
         self.magnetronFreq = mag_freq
+        self.calibration = Calibration(ref_mass, cyclo_freq, mag_freq)
 
         self.__autocalib_mass()
 
@@ -97,17 +498,15 @@ class MassSpectrum(object):
         """
         Process a mass spectrum from a frequency spectrum.
 
-        Populate massSpectrum[].
         Populate mass[] with uma.
         """
-        A = self.refMass * self.cyclotronFreq
-        B = self.refMass * \
-            (self.cyclotronFreq - self.magnetronFreq) * self.magnetronFreq
-        maxMass = A * A / (4 * B)
-        minFreq = 2 * B / A
-        self.mass += maxMass
-        mask = [self.f > minFreq]
-        self.mass[mask] = A / self.f[mask] - B / (self.f[mask] ** 2)
+        self.mass = self.calibration.mass(self.f)
+
+    def window(self, mass1, mass2):
+        """
+        Return the slice of freq[] and mass[] between mass1 and mass2.
+        """
+        return self.calibration.window(self.f, mass1, mass2)
 
     def __uncalib_mass(self, freq):
         """
@@ -118,30 +517,33 @@ class MassSpectrum(object):
 
         :param spectrum: frequency spectrum
         """
-        n = len(freq)
-        mass = []
         q = constants.codata.value('elementary charge')  # 1.602176565e-19 C
         uma = constants.codata.value(
             'atomic mass constant')  # 1.660538921e-27 kg
         B0 = 5  # 5 Tesla for PIRENEA
-        for i in range(n):
-            mass.append(q * B0 / (freq[i] * 2 * np.pi * uma))
-        self.mass = mass
-
-    def basic_recalibrate(self, ref_mass, accuracy):
-        """ Basic auto calibration with a known reference mass. """
-        xx = np.array(self.mass)
-        r = ref_mass
-        y = self.spectrum
-        mask = [(xx > (r - accuracy)) & (xx < (r + accuracy))]
-        maxy = max(y[mask])
-        bad_mass = 0.0
-        for i, j in enumerate(y[mask]):
-            if j == maxy:
-                bad_mass = xx[mask][i]
-        delta_mass = (ref_mass / bad_mass)
-        xx = np.array(self.mass) * delta_mass
-        self.mass = xx
+        with np.errstate(divide='ignore'):
+            self.mass = (q * B0 / (2 * np.pi * uma)) / np.asarray(freq, dtype=np.float64)
+
+    def recalibrate(self, calibration):
+        """
+        Replace the calibration law (see MassCalibrator) and update mass[].
+        """
+        self.calibration = calibration
+        self.__autocalib_mass()
+
+    def basic_recalibrate(self, ref_mass, accuracy, spectrum):
+        """
+        Basic auto calibration with a known reference mass : mass[] is
+        scaled so that the highest peak of spectrum around ref_mass is at
+        ref_mass.
+        """
+        window = self.window(ref_mass - accuracy, ref_mass + accuracy)
+        y = np.asarray(spectrum)[window]
+        if len(y) == 0:
+            log.error("No peak around %g : calibration kept", ref_mass)
+            return
+        bad_mass = self.mass[window][np.argmax(y)]
+        self.mass = self.mass * (ref_mass / bad_mass)
 
 
 if __name__ == '__main__':
@@ -187,8 +589,8 @@ if __name__ == '__main__':
     ms = MassSpectrum(x, ref_mass=300.0939, cyclo_freq=255.723e3, mag_freq=0.001e3)
     xx = np.array(ms.mass)
 
-    mask = [(xx > 280.0) & (xx < 310.0)]
-    ax3.plot(xx[mask], y[mask])
+    window = ms.window(280.0, 310.0)
+    ax3.plot(xx[window], y[window])
     ax3.set_xlabel('mass (u.a.m.)')
     ax3.set_ylabel('|rfft|')
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Synthetic PIRENEA signals and files, for benchmarks and checks without the
+data of the experiment.
+"""
+import logging
+import struct
+
+import numpy as np
+from pkg.spectrum import Calibration
+log = logging.getLogger('root')
+
+SCRIPT = """// synthetic PIRENEA script
+B ejection eject 5.0
+B excitation chirp {excitation_ms:.6f}
+1 Excit ejection
+2 Detect excitation
+"""
+
+
+def default_calibration():
+    return Calibration(300.0939, 255.692e3, 0.001e3)
+
+
+def signal_blocks(masses, points=1048576, step=1e-6, amplitudes=None, tau=1.0, noise=20.0,
+                  seed=0, calibration=None, excitation=0.0, block_size=1048576):
+    """
+    Yield successive blocks of a synthetic PIRENEA signal of points samples :
+    one damped sinusoid per mass of masses (frequency given by calibration,
+    amplitude from amplitudes, default 1000.0, time constant tau in s,
+    random phase) plus a white noise of standard deviation noise. The ions
+    are detected after excitation (s) : before, the signal is only noise.
+    The blocks only depend on seed, not on block_size.
+    """
+    if calibration is None:
+        calibration = default_calibration()
+    masses = np.atleast_1d(np.asarray(masses, dtype=np.float64))
+    if amplitudes is None:
+        amplitudes = np.full(len(masses), 1000.0)
+    amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=np.float64), masses.shape)
+    rng = np.random.default_rng(seed)
+    freqs = np.asarray(calibration.freq(masses), dtype=np.float64)
+    phases = rng.uniform(0, 2 * np.pi, len(masses))
+    first = int(round(excitation / step))
+    for start in range(0, points, block_size):
+        stop = min(start + block_size, points)
+        # drawn in sequence, the noise does not depend on block_size
+        block = rng.standard_normal(stop - start) * noise
+        index = np.arange(max(start, first), stop)
+        if index.size:
+            t = (index - first) * step
+            decay = np.exp(-t / tau)
+            for freq, amplitude, phase in zip(freqs, amplitudes, phases):
+                block[index - start] += amplitude * decay * np.sin(2 * np.pi * freq * t + phase)
+        yield start, block
+
+
+def transient(masses, points=1048576, step=1e-6, tau=1.0, noise=20.0, seed=0,
+              calibration=None, amplitudes=None):
+    """
+    Return a synthetic PIRENEA signal in memory (see signal_blocks).
+    """
+    signal = np.zeros(points)
+    for start, block in signal_blocks(masses, points, step, amplitudes, tau, noise, seed,
+                                      calibration, block_size=points):
+        signal[start:start + len(block)] = block
+    return signal
+
+
+def write_file(filename, setup="new", points=1048576, step=1e-6, masses=(300.0939,),
+               amplitudes=None, tau=1.0, noise=20.0, seed=0, calibration=None, excitation=0.0,
+               gain=1.0, offset=0.0, block_size=1048576):
+    """
+    Write a synthetic PIRENEA file (big-endian), block by block so that files
+    of 32M points do not need the whole signal in memory :
+    - setup "new" : number of points (int32), samples (int16, signal =
+      samples * gain + offset), step in s, gain and offset (float32)
+    - setup "old" : number of points (int32), samples (float32), step in
+      microseconds (float32), then a script whose excitation buffer lasts
+      excitation (s), so that Pipeline starts the signal after it.
+    Return the name of the file.
+
+    :Example:
+
+    >>> from pkg.synthetic import write_file
+    >>> write_file("/tmp/SYN_2026_10_18_000.A00", "old", 4194304, 1e-6,
+    ...            masses=[300.0939, 301.1], excitation=0.01)
+    """
+    if setup not in ("new", "old"):
+        raise ValueError("Unknown setup : %s" % setup)
+    with open(filename, mode="wb") as file:
+        file.write(struct.pack(">i", points))
+        for start, block in signal_blocks(masses, points, step, amplitudes, tau, noise, seed,
+                                          calibration, excitation, block_size):
+            if setup == "new":
+                block = np.rint((block - offset) / gain)
+                np.clip(block, -32768, 32767, out=block)
+                file.write(block.astype(">i2").tobytes())
+            else:
+                file.write(block.astype(">f4").tobytes())
+        if setup == "new":
+            file.write(struct.pack(">fff", step, gain, offset))
+        else:
+            file.write(struct.pack(">f", step * 1e6))
+            file.write(SCRIPT.format(excitation_ms=excitation * 1e3).encode('utf_8'))
+    return filename
+
+
+if __name__ == '__main__':
+    pass
+else:
+    log.info("Importing... %s", __name__)
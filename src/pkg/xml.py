@@ -19,14 +19,20 @@ class XMLPirenea(object):
     classdocs
     """
 
-    def __init__(self, filename="default"):
+    def __init__(self, filename="default", text=None):
         """
         Constructor
+
+        :param text: content of the XML file, already read (see pkg.prefetch) :
+                     the file itself is then not read
         """
         self.filename = filename
         self.tree = []
         try:
-            self.tree = etree.parse(self.filename)
+            if text is None:
+                self.tree = etree.parse(self.filename)
+            else:
+                self.tree = etree.ElementTree(etree.fromstring(text))
         except (etree.LxmlError) as error:
             log.error("Unable to parse the XML file: %s, %s", self.filename, error)
         except (OSError) as error:
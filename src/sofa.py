@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#        Copyright (c) IRAP CNRS
+#        Odile Coeur-Joly, Toulouse, France
+#
+"""
+Command line of sofa.
+
+batch : masstab table of many files, processed in parallel.
+
+    python sofa.py batch D:\\PIRENEA\\DATA\\2018\\data_2018_11_06
+        --masses 296 298 300 301 302 --accuracy 0.2 --workers 8
+        --output D:\\PIRENEA\\DATA\\MASS\\masstab.txt
+
+pkg.sofa Created on 18 oct. 2026
+"""
+import argparse
+import sys
+
+from pkg.logs import Logs
+
+
+def batch(args):
+    from pkg.batch import BatchJob, BatchJournal, find_files
+
+    journal_name = "" if args.no_journal else args.journal or args.output + ".journal"
+    filenames = find_files(args.paths, exclude=(args.output, journal_name, args.profile))
+    if not filenames:
+        return 1
+    job = BatchJob(filenames, args.masses, accuracy=args.accuracy, start=args.start,
+                   end=args.end, hann=args.hann, factor=args.factor, ref_mass=args.ref_mass,
+                   cyclo_freq=args.cyclo_freq * 1e3, mag_freq=args.mag_freq * 1e3,
+                   ref_list=args.ref_list, centroid=args.centroid, workers=args.workers,
+                   chunksize=args.chunksize, max_memory=int(args.max_memory * 1024 ** 2),
+                   profile=bool(args.profile))
+    journal = None
+    if journal_name:
+        journal = BatchJournal(journal_name)
+    job.run(journal)
+    job.write(args.output)
+    if args.profile:
+        job.write_profile(args.profile)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sofa", description="PIRENEA SOFtware Analysis")
+    parser.add_argument("--log", choices=["debug", "info", "error"], default="info",
+                        help="log level")
+    commands = parser.add_subparsers(dest="command")
+
+    parser_batch = commands.add_parser("batch", help="masstab table of many files")
+    parser_batch.add_argument("paths", nargs="+",
+                              help="directories, glob patterns or files to process")
+    parser_batch.add_argument("-m", "--masses", nargs="+", type=float, required=True,
+                              help="masses of the table (u)")
+    parser_batch.add_argument("-o", "--output", default="masstab.txt",
+                              help="masstab file written")
+    parser_batch.add_argument("--accuracy", type=float, default=0.2,
+                              help="accuracy of the peak search (u)")
+    parser_batch.add_argument("--start", type=int, default=0,
+                              help="first sample of the signals (default : from the script)")
+    parser_batch.add_argument("--end", type=int, default=0,
+                              help="last sample of the signals (default : from the script)")
+    parser_batch.add_argument("--hann", action="store_true", help="Hann window")
+    parser_batch.add_argument("--factor", type=float, default=1000.0,
+                              help="scale factor of the spectra")
+    parser_batch.add_argument("--ref-mass", type=float, default=300.0939,
+                              help="reference mass of the calibration (u)")
+    parser_batch.add_argument("--cyclo-freq", type=float, default=255.692,
+                              help="cyclotron frequency of the calibration (kHz)")
+    parser_batch.add_argument("--mag-freq", type=float, default=0.001,
+                              help="magnetron frequency of the calibration (kHz)")
+    parser_batch.add_argument("--ref-list", nargs="*", type=float, default=[],
+                              help="reference masses to refit the calibration of each file")
+    parser_batch.add_argument("--centroid", choices=["parabolic", "gaussian"], default=None,
+                              help="interpolation of the peaks between bins")
+    parser_batch.add_argument("-w", "--workers", type=int, default=0,
+                              help="worker processes (default : number of cores)")
+    parser_batch.add_argument("--chunksize", type=int, default=1,
+                              help="files sent at once to a worker")
+    parser_batch.add_argument("--max-memory", type=float, default=0,
+                              help="memory limit of each worker (MB, default : none)")
+    parser_batch.add_argument("--journal", default="",
+                              help="journal of the files processed, to skip them when the "
+                              "job is run again (default : output file + .journal)")
+    parser_batch.add_argument("--no-journal", action="store_true",
+                              help="process all the files, without journal")
+    parser_batch.add_argument("--profile", default="",
+                              help="json file of the time, bytes read and memory of the "
+                              "stages of each file, with their p50/p95 per stage")
+    parser_batch.set_defaults(func=batch)
+
+    args = parser.parse_args(argv)
+    Logs('root').setup_logger(args.log)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
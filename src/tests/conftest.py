@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of pkg, on synthetic PIRENEA files (see pkg.synthetic).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of pkg.batch.
+"""
+from pkg.batch import find_files
+from pkg.synthetic import write_file
+
+
+def test_find_files_excludes_outputs(tmp_path, monkeypatch):
+    data = [write_file(str(tmp_path / ("P1_2026_10_18_00%d.A00" % i)), "new", 1024)
+            for i in range(2)]
+    output = str(tmp_path / "masstab.txt")
+    for filename in (output, output + ".journal", str(tmp_path / "P1_2026_10_18_000.xml")):
+        with open(filename, "w") as file:
+            file.write("\n")
+    # the output as given on the command line, relative to the directory
+    monkeypatch.chdir(str(tmp_path))
+    assert find_files([str(tmp_path)], exclude=("masstab.txt", output + ".journal")) == data
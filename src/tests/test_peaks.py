@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of pkg.peaks.
+"""
+import time
+
+import numpy as np
+from benchmark import detect_peaks_legacy, noise_spectrum
+from pkg.peaks import Peaks
+
+
+def test_suppress_close_as_legacy():
+    x = np.round(noise_spectrum(100000))
+    candidates = Peaks().detect_peaks(x, mpd=1)
+    for mpd, kpsh in ((2, False), (20, False), (20, True)):
+        legacy = detect_peaks_legacy(x, candidates, mpd, kpsh)
+        assert np.array_equal(Peaks().detect_peaks(x, mpd=mpd, kpsh=kpsh), legacy)
+
+
+def test_suppress_close_scales():
+    x = noise_spectrum(1000000)
+    start = time.perf_counter()
+    ind = Peaks().detect_peaks(x, mpd=20)
+    # 97 s when each peak kept was inserted in a sorted list
+    assert time.perf_counter() - start < 20.0
+    assert np.all(np.diff(ind) > 20)
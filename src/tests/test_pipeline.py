@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of pkg.pipeline.
+"""
+import numpy as np
+from pkg.pipeline import Pipeline
+from pkg.spectrum import Calibration, ZoomSpectrum
+from pkg.synthetic import write_file
+
+REF_MASS = 300.0939
+CYCLO_FREQ = 255.692e3
+MAG_FREQ = 0.001e3
+
+
+def synthetic_file(tmp_path, points=1048576):
+    return write_file(str(tmp_path / "SYN_000.A00"), "new", points, 1e-6, [REF_MASS], tau=0.5)
+
+
+def zoom_peak(pip):
+    pip.process_zoom(299.0, 301.0, 0, 1000.0, REF_MASS, CYCLO_FREQ, MAG_FREQ)
+    i = np.argmax(pip.spectrum)
+    return pip.mass[i], pip.spectrum[i]
+
+
+def full_zoom_peak(pip):
+    """
+    Peak of the chirp-z transform of the full signal : the pipeline only
+    zooms a baseband signal.
+    """
+    pip.process_signal(pip.start, pip.end)
+    cal = Calibration(REF_MASS, CYCLO_FREQ, MAG_FREQ)
+    zs = ZoomSpectrum(pip.signal, pip.signal_step, cal.freq(301.0), cal.freq(299.0),
+                      factor=1000.0)
+    i = np.argmax(zs.spectrum)
+    return float(cal.mass(np.array(zs.freq[i]))), zs.spectrum[i]
+
+
+def downconvert(pip):
+    center = Calibration(REF_MASS, CYCLO_FREQ, MAG_FREQ).freq(300.0)
+    pip.process_downconvert(pip.start, pip.end, center, 64)
+
+
+def test_zoom_after_downconvert(tmp_path):
+    pip = Pipeline(synthetic_file(tmp_path))
+    mass, height = full_zoom_peak(pip)
+    downconvert(pip)
+    ddc_mass, ddc_height = zoom_peak(pip)
+    assert abs(ddc_mass - REF_MASS) < 0.001
+    assert abs(ddc_mass - mass) < 1e-6
+    assert abs(ddc_height / height - 1.0) < 0.01
+
+
+def test_no_zoom_of_full_signal(tmp_path):
+    pip = Pipeline(synthetic_file(tmp_path))
+    pip.process_signal(pip.start, pip.end)
+    pip.process_zoom(299.0, 301.0, 0, 1000.0, REF_MASS, CYCLO_FREQ, MAG_FREQ)
+    assert "spectrum" not in pip.stages
+
+
+def test_downconvert_after_coadd(tmp_path):
+    first = synthetic_file(tmp_path)
+    second = write_file(str(tmp_path / "SYN_000.A01"), "new", 1048576, 1e-6, [REF_MASS],
+                        amplitudes=[3000.0], tau=0.5)
+    single_mass, single_height = full_zoom_peak(Pipeline(first))
+    pip = Pipeline(first)
+    pip.coadd([first, second])
+    mass, height = full_zoom_peak(pip)
+    downconvert(pip)
+    ddc_mass, ddc_height = zoom_peak(pip)
+    # mean of amplitudes 1000 and 3000, same phase (same seed)
+    assert abs(height / single_height - 2.0) < 0.05
+    assert abs(ddc_mass - mass) < 1e-6
+    assert abs(ddc_height / height - 1.0) < 0.01
+
+
+def test_zoom_dtype_and_cache(tmp_path):
+    from pkg.cache import SpectrumCache
+
+    filename = synthetic_file(tmp_path)
+    cache = SpectrumCache(str(tmp_path / "cache"))
+    pip = Pipeline(filename, dtype=np.float32, spectrum_cache=cache)
+    downconvert(pip)
+    mass, height = zoom_peak(pip)
+    assert pip.spectrum.dtype == np.float32
+    assert abs(mass - REF_MASS) < 0.001
+    cached = Pipeline(filename, dtype=np.float32, spectrum_cache=cache)
+    downconvert(cached)
+    assert zoom_peak(cached) == (mass, height)
+    assert isinstance(cached.spectrum, np.memmap)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of pkg.spectrum.
+"""
+import numpy as np
+from pkg.peaks import Peaks
+from pkg.pipeline import Pipeline
+from pkg.spectrum import Calibration, FrequencySpectrum, MassCalibrator
+from pkg.synthetic import transient, write_file
+
+TRUE = Calibration(300.0939, 255.692e3, 0.001e3)
+MASSES = [200.0, 250.0, 300.0939, 301.1, 350.0, 400.0]
+
+
+def spectrum(points=4194304, step=1e-6):
+    signal = transient(MASSES, points, step, tau=0.5, calibration=TRUE) * np.hanning(points)
+    return FrequencySpectrum(signal, step)
+
+
+def refit(fs, refs):
+    start = Calibration(300.0939, 255.700e3, 0.001e3)
+    cal = MassCalibrator(refs, 0.2)
+    return cal.fit(cal.find_references(fs.freq, fs.spectrum, start), start)
+
+
+def ppm(law, mass):
+    return abs(float(law.mass(np.array(TRUE.freq(mass)))) / mass - 1.0) * 1e6
+
+
+def test_narrow_span_keeps_masses():
+    law = refit(spectrum(), [300.0939, 301.1])
+    assert abs(law.B / TRUE.B - 1.0) < 1e-4
+    for mass in MASSES:
+        assert ppm(law, mass) < 0.05
+
+
+def test_wide_span_fits_b():
+    law = refit(spectrum(), [200.0, 250.0, 300.0939, 350.0, 400.0])
+    assert abs(law.B / TRUE.B - 1.0) < 0.01
+    for mass in MASSES:
+        assert ppm(law, mass) < 0.05
+
+
+def test_single_precision_spectrum(tmp_path):
+    filename = write_file(str(tmp_path / "SYN_000.A00"), "new", 4194304, 1e-6,
+                          [200.0, 300.0939, 301.1], tau=0.5, calibration=TRUE)
+    spectra = []
+    for dtype in (np.float64, np.float32):
+        pip = Pipeline(filename, dtype=dtype)
+        pip.process_signal(pip.start, pip.end)
+        pip.process_spectrum(1000.0, 300.0939, 255.692e3, 0.001e3)
+        spectra.append(pip.spectrum)
+    double, single = spectra
+    assert single.dtype == np.float32
+    highest = np.max(double)
+    # the bound given in the FrequencySpectrum docstring (1.4e-7 measured)
+    assert np.max(np.abs(single - double)) < 1e-6 * highest
+    peaks = [Peaks().detect_peaks(spectrum, mph=0.01 * highest, mpd=20) for spectrum in spectra]
+    assert np.array_equal(peaks[0], peaks[1])